@@ -0,0 +1,220 @@
+"""Пакетный разбор истории каналов: статистика использования AFK и проверка парсера.
+
+Читает выгрузку Slack (zip-архив или распакованный каталог экспорта, либо
+JSONL с одним сообщением или событием на строку), пропускает сообщения
+через тот же фильтр и parse_time_to_minutes, что и бот, и сохраняет
+результат в колоночном виде.
+
+    python afk_backfill.py export.zip --out afk_usage.json.gz --workers 4
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import zipfile
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from afk_parser import AFK_PREFILTER, is_new_user_message, parse_time_with_rule
+
+COLUMNS = ("channel", "ts", "user", "rule", "capped", "original")
+# Колонки с повторяющимися строками хранятся словарём значений и индексами
+DICTIONARY_COLUMNS = ("channel", "user", "rule")
+# Файлы в корне экспорта Slack, которые не являются историей каналов
+EXPORT_METADATA_FILES = {"users.json", "channels.json", "groups.json", "dms.json", "mpims.json",
+                         "integration_logs.json", "canvases.json", "org_users.json"}
+# Размер задачи для stdin (строк) и для экспорта (файлов дней канала)
+STDIN_CHUNK_LINES = 50000
+EXPORT_FILES_PER_TASK = 20
+
+def _new_result():
+    return {name: [] for name in COLUMNS}, {"messages": 0, "candidates": 0, "parsed": 0}
+
+def _collect(columns, stats, channel, message):
+    """Фильтр и разбор одного сообщения, как в обработчике бота"""
+    stats["messages"] += 1
+    if message.get("type", "message") != "message" or not is_new_user_message(message):
+        return
+    text = message.get("text")
+    if not isinstance(text, str) or not AFK_PREFILTER.search(text):
+        return
+    stats["candidates"] += 1
+    ts = message.get("ts")
+    try:
+        # "до 12" считаем от момента отправки сообщения, а не от текущего времени
+        sent_at = datetime.datetime.fromtimestamp(float(ts)) if ts else None
+        rule, result = parse_time_with_rule(text, sent_at)
+    except ValueError:
+        return
+    if result is None:
+        return
+    stats["parsed"] += 1
+    columns["channel"].append(channel or message.get("channel", ""))
+    columns["ts"].append(ts or "")
+    columns["user"].append(message.get("user", ""))
+    columns["rule"].append(rule)
+    columns["capped"].append(result[0])
+    columns["original"].append(result[1])
+
+def process_jsonl_lines(lines):
+    """Разобрать пачку строк JSONL: сообщение или событие {"event": {...}} на строку"""
+    columns, stats = _new_result()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        # Строки, которые не являются объектами сообщений, пропускаем так же, как невалидный JSON
+        if not isinstance(record, dict):
+            continue
+        message = record.get("event", record)
+        if not isinstance(message, dict):
+            continue
+        _collect(columns, stats, message.get("channel"), message)
+    return columns, stats
+
+def process_jsonl_range(path, start, end):
+    """Разобрать часть файла JSONL между смещениями start и end (границы строк)"""
+    with open(path, "rb") as jsonl_file:
+        jsonl_file.seek(start)
+        data = jsonl_file.read(end - start)
+    return process_jsonl_lines(data.decode("utf-8").splitlines())
+
+def process_export_files(source, names):
+    """Разобрать файлы дней из экспорта Slack (<канал>/<дата>.json)"""
+    columns, stats = _new_result()
+    archive = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+    try:
+        for name in names:
+            if archive is not None:
+                data = archive.read(name)
+            else:
+                with open(os.path.join(source, name), "rb") as day_file:
+                    data = day_file.read()
+            channel = os.path.dirname(name).replace("\\", "/").rsplit("/", 1)[-1]
+            for message in json.loads(data):
+                if isinstance(message, dict):
+                    _collect(columns, stats, channel, message)
+    finally:
+        if archive is not None:
+            archive.close()
+    return columns, stats
+
+def _export_day_files(source):
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = archive.namelist()
+    else:
+        names = [
+            os.path.relpath(os.path.join(root, file_name), source)
+            for root, _, files in os.walk(source)
+            for file_name in files
+        ]
+    return sorted(
+        name for name in names
+        if name.endswith(".json") and os.path.basename(name) not in EXPORT_METADATA_FILES
+        and os.path.dirname(name)
+    )
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _jsonl_ranges(path, chunk_bytes):
+    """Разбить файл на диапазоны байт по границам строк, чтобы процессы читали его сами"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as jsonl_file:
+        start = 0
+        while start < size:
+            jsonl_file.seek(min(start + chunk_bytes, size))
+            jsonl_file.readline()
+            end = min(jsonl_file.tell(), size)
+            yield start, end
+            start = end
+
+def iter_tasks(source, chunk_mb):
+    """Единицы работы: (функция, аргументы) - части JSONL или пачки файлов экспорта"""
+    if source == "-":
+        for lines in _chunks(sys.stdin, STDIN_CHUNK_LINES):
+            yield process_jsonl_lines, (lines,)
+    elif os.path.isdir(source) or zipfile.is_zipfile(source):
+        for names in _chunks(_export_day_files(source), EXPORT_FILES_PER_TASK):
+            yield process_export_files, (source, names)
+    else:
+        for start, end in _jsonl_ranges(source, int(chunk_mb * 1024 * 1024)):
+            yield process_jsonl_range, (source, start, end)
+
+def run_tasks(tasks, workers):
+    """Выполнить задачи по порядку, при workers > 1 - в пуле процессов с ограниченной очередью"""
+    if workers <= 1:
+        for function, args in tasks:
+            yield function(*args)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = []
+        for function, args in tasks:
+            in_flight.append(pool.submit(function, *args))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.pop(0).result()
+        for future in in_flight:
+            yield future.result()
+
+def backfill(source, workers=1, chunk_mb=8):
+    """Разобрать выгрузку целиком, вернуть (колонки, статистика)"""
+    columns, stats = _new_result()
+    for part_columns, part_stats in run_tasks(iter_tasks(source, chunk_mb), workers):
+        for name in COLUMNS:
+            columns[name].extend(part_columns[name])
+        for name in stats:
+            stats[name] += part_stats[name]
+    return columns, stats
+
+def encode_columns(columns):
+    """Компактное колоночное представление: строковые колонки кодируются словарём"""
+    encoded = {}
+    for name in COLUMNS:
+        values = columns[name]
+        if name in DICTIONARY_COLUMNS:
+            dictionary = {}
+            indices = [dictionary.setdefault(value, len(dictionary)) for value in values]
+            encoded[name] = {"dictionary": list(dictionary), "indices": indices}
+        else:
+            encoded[name] = values
+    return {"rows": len(columns["ts"]), "columns": encoded}
+
+def write_columns(columns, path):
+    data = json.dumps(encode_columns(columns), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wb") as output:
+        output.write(data)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный разбор команд AFK в выгрузке истории Slack")
+    parser.add_argument("source", help="zip-архив или каталог экспорта Slack, файл JSONL или '-' для stdin")
+    parser.add_argument("--out", default="afk_backfill.json.gz", help="файл результата (.json или .json.gz)")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов для разбора")
+    parser.add_argument("--chunk-mb", type=float, default=8, help="размер части файла JSONL на одну задачу, МБ")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    columns, stats = backfill(args.source, args.workers, args.chunk_mb)
+    write_columns(columns, args.out)
+    elapsed = time.perf_counter() - started
+
+    rate = stats["messages"] / elapsed * 60 if elapsed else 0
+    print(f"Сообщений: {stats['messages']}, с упоминанием AFK: {stats['candidates']}, "
+          f"разобрано: {stats['parsed']}")
+    print(f"Время: {elapsed:.1f} с ({rate:,.0f} сообщений в минуту), результат: {args.out}")
+
+if __name__ == "__main__":
+    main()
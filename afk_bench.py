@@ -0,0 +1,1289 @@
+"""Нагрузочные замеры бота на фейковом Slack: пропускная способность, задержки, память, потоки.
+
+Slack не нужен: Web API заменяет FakeSlack (HTTP-сервер в том же процессе
+с настраиваемой задержкой, ошибками и ответами 429), а Socket Mode -
+FakeSocketMode, который передаёт конверты событий в приложение Bolt так же,
+как SocketModeHandler. Сценарии:
+
+    parse   - parse_time_to_minutes на корпусе сообщений (холодный и прогретый кэш) и на журнале
+              с частотами по Ципфу: доля попаданий parse_cache и fuzzy_cache
+    prefilter - AFK_PREFILTER против прежней проверки подстрок после lower() на корпусе
+              русско-английской переписки
+    typos   - поиск опечаток AFK в коротких сообщениях: find_afk_typos против прежнего is_similar_to_afk
+    grammar - стоимость разбора одной команды без кэша: грамматика afk_parser против
+              прежнего каскада TIME_PATTERNS (tests/baseline_parser.py)
+    intake  - события через Bolt в handle_message_events: время до ack и до установки статусов
+    status  - set_user_status против фейкового Web API
+    modes   - пачка команд AFK в синхронном и асинхронном режимах: события в секунду и p99
+    profile - вызовы users.profile.get/set на команду AFK без кэша профилей и с ProfileCache
+    clear   - clear_status через планировщик и диспетчер: задержка очистки после срока
+    restart - перезапуск с 100 000 строк в SQLiteStatusStore: загрузка базы и восстановление очисток
+    ratelimit - очистки статусов, когда фейковый Slack отвечает 429 сверх лимита: пропускная
+              способность против лимита и потерянные очистки
+    backfill - пакетный разбор синтетической выгрузки JSONL (afk_backfill) в 1 и N процессах:
+              сообщения в минуту
+    cluster - от 1 до N процессов бота с общим хранилищем: статусы в секунду, ускорение и то,
+              что каждая очистка выполняется ровно один раз
+    scheduler - 100 000 запланированных очисток в ExpiryScheduler: потоки, память, задержка срабатывания
+    importtime - холодный запуск: python -X importtime -c "import afk_parser/afk_bot" против бюджета
+    logging - extract_afk_command на переписке без AFK при уровнях INFO и DEBUG и с прежним print()
+    metrics - цена метрик на событие в extract_afk_command против бюджета (0.25 мкс без AFK,
+              1.5 мкс на команду AFK)
+    table   - StatusTable без Slack: память на пользователя и стоимость выборки и очистки
+              истёкших статусов (по умолчанию 1 000 000 пользователей, --table-users)
+
+    python afk_bench.py --save bench_baseline.json
+    python afk_bench.py --latency-ms 50 --rate-limit-rate 0.02 --compare bench_baseline.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import platform
+import threading
+import statistics
+import subprocess
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from afk_parser import AFK_PREFILTER, find_afk_typos, parse_cache, fuzzy_cache, parse_time_to_minutes
+from afk_logging import JsonFormatter, RecordQueueHandler, configure_logging
+
+# Форматы из README и их варианты
+AFK_TEMPLATES = [
+    "афк {m}", "AFK {h}h", "афк {h}.5 часа", "афк полчаса", "AFK half hour", "афк час", "afk one hour",
+    "Нужно отойти, афк {m} минут", "афк до {hh}:{mm}", "АФК по семейным до {hh}", "afk until {hh}",
+    "афк {a}-{b}", "афк 1-1.5", "афк 0,5", "афк 1,5", "афк {h}ч", "афк {m}m", "афк {m} мин", "afk {m} min",
+    "Еще {m} мин афк", "still {m} min afk", "Плохо себя чувствую. АФК минут {m}", "аfк {m}", "афл {m}",
+    "AFK", "афк, скоро вернусь",
+]
+# Обычные сообщения, в том числе с числами и "мин" - их должен отсечь быстрый фильтр
+CHATTER = [
+    "Привет! Кто посмотрит мой PR?", "созвон через 5 минут", "Обед в 13:00?", "выкатил релиз, проверьте",
+    "у меня 2 вопроса по задаче", "спасибо, посмотрю минут через 10", "Кто-нибудь знает, где логи стенда?",
+    "ребята, тесты опять падают", "ок, договорились", "перенесём встречу на 15:30", "мин. версия питона 3.9",
+    "deploy is done", "see you at standup", "I'll be back in 10 min", "can someone review #1234?",
+    "lunch?", "build is green again", "meeting moved to 3pm", "afternoon everyone", "thanks, merging now",
+]
+
+def generate_corpus(count, afk_share=0.05, seed=0):
+    """Корпус сообщений: доля afk_share - команды AFK в форматах README, остальное - обычная переписка"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        if rnd.random() < afk_share:
+            a = rnd.randint(5, 60)
+            corpus.append(rnd.choice(AFK_TEMPLATES).format(
+                m=rnd.randint(1, 120), h=rnd.randint(1, 5), a=a, b=a + rnd.randint(5, 60),
+                hh=rnd.randint(0, 23), mm=f"{rnd.choice((0, 15, 30, 45)):02d}"
+            ))
+        else:
+            corpus.append(" ".join(rnd.choice(CHATTER) for _ in range(rnd.randint(1, 3))))
+    return corpus
+
+class _FakeSlackServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь соединений больше стандартных 5, иначе одновременные вызовы ждут повторного SYN
+    request_queue_size = 128
+
+class FakeSlack:
+    """Фейковый Slack Web API в том же процессе.
+
+    Каждый вызов отвечает через latency секунд; с вероятностью rate_limit_rate
+    возвращается 429 с Retry-After, с вероятностью error_rate - ошибка Slack
+    (ok: false). method_limits ({метод: (вызовов в минуту, пачка)}, как
+    SLACK_METHOD_LIMITS) включает настоящий лимит: сверх него - 429 с
+    Retry-After до следующего разрешённого вызова. Профили пользователей хранятся в памяти, а момент последнего
+    ответа на очистку статуса (status_text == "", кроме 429) - в cleared,
+    а успешной установки статуса AFK - в updated.
+    """
+
+    def __init__(self, latency=0.02, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, method_limits=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.method_limits = method_limits or {}
+        self._allowance = {}  # метод -> [доступно вызовов, время пополнения]
+        self.calls = Counter()
+        self.profiles = {}
+        self.cleared = {}
+        self.updated = {}
+        self._lock = threading.Lock()
+        self._server = _FakeSlackServer(("127.0.0.1", 0), self._handler_class())
+        threading.Thread(target=self._server.serve_forever, name="fake-slack", daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/"
+
+    def client(self):
+        from slack_sdk import WebClient
+        return WebClient(token="xoxp-bench", base_url=self.base_url)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method, params):
+        """(HTTP-код, заголовки, ответ) для вызова метода Web API"""
+        with self._lock:
+            self.calls[method] += 1
+            retry_after = self._over_limit(method)
+            if retry_after is None and random.random() < self.rate_limit_rate:
+                retry_after = self.retry_after
+            if retry_after is not None:
+                self.calls["ratelimited"] += 1
+        time.sleep(self.latency)
+        if retry_after is not None:
+            return 429, {"Retry-After": str(retry_after)}, {"ok": False, "error": "ratelimited"}
+        profile = params.get("profile") or {}
+        if isinstance(profile, str):
+            profile = json.loads(profile)
+        failed = method != "auth.test" and random.random() < self.error_rate
+        with self._lock:
+            if method == "users.profile.set" and not profile.get("status_text"):
+                self.cleared[params.get("user")] = time.time()
+            elif method == "users.profile.set" and not failed:
+                self.updated[params.get("user")] = time.time()
+            if failed:
+                self.calls["errors"] += 1
+        if failed:
+            return 200, {}, {"ok": False, "error": "internal_error"}
+        if method == "auth.test":
+            return 200, {}, {"ok": True, "user_id": "UBENCH", "team_id": "TBENCH"}
+        if method == "users.profile.get":
+            with self._lock:
+                profile = self.profiles.get(params.get("user"), {"status_text": "", "status_emoji": ""})
+            return 200, {}, {"ok": True, "profile": profile}
+        if method == "users.profile.set":
+            with self._lock:
+                self.profiles[params.get("user")] = profile
+            return 200, {}, {"ok": True, "profile": profile}
+        if method == "emoji.list":
+            return 200, {}, {"ok": True, "emoji": {"afk": "https://example.invalid/afk.png"}}
+        return 200, {}, {"ok": True}
+
+    def _over_limit(self, method):
+        """Retry-After в секундах, если вызов превышает method_limits, иначе None"""
+        if method not in self.method_limits:
+            return None
+        per_minute, burst = self.method_limits[method]
+        rate = per_minute / 60.0
+        now = time.monotonic()
+        tokens, updated = self._allowance.get(method, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            self._allowance[method] = [tokens - 1, now]
+            return None
+        self._allowance[method] = [tokens, now]
+        return max(1, math.ceil((1 - tokens) / rate))
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(data or "{}")
+                else:
+                    params = {key: values[-1] for key, values in urllib.parse.parse_qs(data).items()}
+                status, headers, payload = fake.handle(self.path.rsplit("/", 1)[-1], params)
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+class FakeSocketMode:
+    """Доставка событий в приложение Bolt, как у SocketModeHandler: конверт -> app.dispatch -> ack"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def deliver(self, event, team_id="TBENCH"):
+        """Передать событие; возвращает время до ack в секундах"""
+        from slack_bolt.request import BoltRequest
+
+        body = {"type": "event_callback", "team_id": team_id, "event": event}
+        started = time.perf_counter()
+        self.app.dispatch(BoltRequest(body=body, mode="socket_mode"))
+        return time.perf_counter() - started
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _process_stats():
+    """Пиковая память процесса (МБ) и число живых потоков"""
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux - килобайты, macOS - байты
+        rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except ImportError:
+        rss_mb = None
+    return {"peak_rss_mb": round(rss_mb, 1) if rss_mb is not None else None, "threads": threading.active_count()}
+
+def _summary(latencies, elapsed, **extra):
+    result = {
+        "count": len(latencies),
+        "throughput_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 4) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 4) if latencies else None,
+    }
+    result.update(extra)
+    result.update(_process_stats())
+    return result
+
+def _wait_until(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def _baseline_parser():
+    """Прежний парсер (tests/baseline_parser.py, эталон тестов) по пути рядом с afk_bench.py.
+
+    tests/ - не пакет, поэтому каталог добавляется в sys.path явно: так
+    сценарии работают при запуске из любого каталога.
+    """
+    tests_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests")
+    if tests_dir not in sys.path:
+        sys.path.append(tests_dir)
+    import baseline_parser
+    return baseline_parser
+
+def _cache_stats(cache, before):
+    """Попадания, промахи и вытеснения BoundedCache с момента снимка before"""
+    stats = {key: cache.stats[key] - before[key] for key in ("hits", "misses", "evictions")}
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+    return stats
+
+def _parse_pass(texts):
+    parse_before, fuzzy_before = dict(parse_cache.stats), dict(fuzzy_cache.stats)
+    latencies = []
+    started = time.perf_counter()
+    for text in texts:
+        call_started = time.perf_counter()
+        parse_time_to_minutes(text)
+        latencies.append(time.perf_counter() - call_started)
+    return _summary(
+        latencies, time.perf_counter() - started,
+        parse_cache=_cache_stats(parse_cache, parse_before), fuzzy_cache=_cache_stats(fuzzy_cache, fuzzy_before)
+    )
+
+def zipf_replay(count, distinct, seed=0, exponent=1.1):
+    """Журнал из count сообщений: distinct разных сообщений корпуса с частотами по закону Ципфа"""
+    rnd = random.Random(seed)
+    vocabulary = list(dict.fromkeys(generate_corpus(distinct, afk_share=0.5, seed=seed)))
+    # Шаблонов мало: недостающие разные сообщения получают обращение к коллеге (без букв AFK и цифр)
+    seen = set(vocabulary)
+    while len(vocabulary) < distinct:
+        mention = "@" + "".join(rnd.choice("bcdeghijmnopqrstuvwxyz") for _ in range(6))
+        text = f"{rnd.choice(vocabulary)} {mention}"
+        if text not in seen:
+            seen.add(text)
+            vocabulary.append(text)
+    rnd.shuffle(vocabulary)
+    weights = [1 / rank ** exponent for rank in range(1, distinct + 1)]
+    return rnd.choices(vocabulary, weights, k=count)
+
+def bench_parse(corpus, replay=100_000, seed=0):
+    """parse_time_to_minutes: корпус с пустым и прогретым кэшем, затем повтор журнала сообщений.
+
+    Журнал повторяет сообщения с частотами по закону Ципфа: в replay_fits
+    разных сообщений меньше, чем мест в parse_cache (4096), в replay_overflow -
+    в десять раз больше. Для каждого прохода выводятся попадания, промахи,
+    вытеснения и доля попаданий parse_cache и fuzzy_cache.
+    """
+    results = {}
+    for name, texts, distinct in (
+        ("cold", corpus, None), ("warm", corpus, None),
+        ("replay_fits", None, parse_cache.max_size // 2), ("replay_overflow", None, parse_cache.max_size * 10),
+    ):
+        if texts is None:
+            texts = zipf_replay(replay, distinct, seed)
+        if name != "warm":
+            parse_cache.clear()
+            fuzzy_cache.clear()
+        results[name] = _parse_pass(texts)
+        if distinct is not None:
+            results[name]["distinct_messages"] = distinct
+    return results
+
+def bench_prefilter(corpus, repeat=5):
+    """Быстрая проверка входящих сообщений: AFK_PREFILTER.search против прежней проверки подстрок AFK_WORDS после lower()"""
+    mentions_afk = _baseline_parser().mentions_afk
+    results = {}
+    for name, check in (("prefilter", AFK_PREFILTER.search), ("substrings", mentions_afk)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            accepted = sum(1 for text in corpus if check(text))
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "messages": len(corpus) * repeat,
+            "accepted": accepted,
+            "per_message_us": round(elapsed / (len(corpus) * repeat) * 10 ** 6, 4),
+            "throughput_per_s": round(len(corpus) * repeat / elapsed, 1),
+        }
+    results["same_messages"] = all(bool(AFK_PREFILTER.search(text)) == mentions_afk(text) for text in corpus)
+    results["speedup"] = round(results["substrings"]["per_message_us"] / results["prefilter"]["per_message_us"], 2)
+    return results
+
+def bench_typos(corpus, seed=0, typos=20000, repeat=3):
+    """Поиск опечаток AFK в коротких сообщениях: find_afk_typos против прежнего is_similar_to_afk (fuzz.ratio).
+
+    Это путь разбора сообщений до 30 символов без точного слова AFK: каждое
+    слово сравнивается с "afk" и "афк". К коротким сообщениям корпуса
+    добавляются typos сообщений вида "<опечатка> <минуты>". find_afk_typos
+    меряется без кэша (fuzzy_cache очищается перед каждым сообщением) и с
+    кэшем. Прежняя проверка кэша не имела; она меряется с fuzzywuzzy и
+    python-Levenshtein, как в боте (если установлены), и с той же формулой
+    на Python из tests/baseline_parser.py. Ускорение считается относительно
+    fuzzywuzzy, а без него - относительно формулы на Python.
+    """
+    rnd = random.Random(seed)
+    messages = [text for text in corpus if len(text) <= 30 and not AFK_PREFILTER.search(text)]
+    messages += [
+        "".join(rnd.choice("afkафклlxs") for _ in range(rnd.randint(2, 4))) + f" {rnd.randint(1, 60)}"
+        for _ in range(typos)
+    ]
+    word_lists = [text.lower().split() for text in messages]
+    words = sum(len(word_list) for word_list in word_lists)
+    baseline_parser = _baseline_parser()
+
+    def uncached(word_list):
+        fuzzy_cache.clear()
+        return find_afk_typos(word_list)
+
+    def baseline_python(word_list):
+        return [baseline_parser.is_similar_to_afk(word) for word in word_list]
+
+    checks = [("find_afk_typos_uncached", uncached), ("find_afk_typos_cached", find_afk_typos),
+              ("baseline_python_ratio", baseline_python)]
+    try:
+        from fuzzywuzzy import fuzz
+
+        def baseline_fuzzywuzzy(word_list):
+            verdicts = []
+            for word in word_list:
+                word_lower = word.lower()
+                verdicts.append(word_lower in baseline_parser.AFK_WORDS
+                                or fuzz.ratio(word_lower, "afk") > 75 or fuzz.ratio(word_lower, "афк") > 75)
+            return verdicts
+
+        checks.append(("baseline_fuzzywuzzy", baseline_fuzzywuzzy))
+    except ImportError:
+        pass
+
+    results = {"messages": len(messages), "words": words}
+    for name, check in checks:
+        fuzzy_cache.clear()
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            verdicts = [check(word_list) for word_list in word_lists]
+            best = min(best, time.perf_counter() - started)
+        results[name] = {
+            "per_message_us": round(best / len(messages) * 10 ** 6, 4),
+            "per_word_us": round(best / words * 10 ** 6, 4),
+            "typos_found": sum(sum(verdict) for verdict in verdicts),
+        }
+    reference = results.get("baseline_fuzzywuzzy", results["baseline_python_ratio"])
+    for name in ("find_afk_typos_uncached", "find_afk_typos_cached"):
+        results[name]["speedup"] = round(reference["per_message_us"] / results[name]["per_message_us"], 2)
+    return results
+
+def bench_grammar(corpus, repeat=5):
+    """Разбор команд AFK без кэша: однопроходная грамматика против прежнего каскада регулярных выражений.
+
+    Отдельно меряется длинное сообщение формата "до 12", на котором каскад
+    с ведущим '.*' в правилах mix_2 и until_time перебирает весь текст.
+    """
+    cascade_parse_time_to_minutes = _baseline_parser().parse_time_to_minutes
+
+    commands = [text.lower().strip() for text in corpus if AFK_PREFILTER.search(text)]
+    long_message = "Коллеги, " + "сегодня много встреч и созвонов по релизу, " * 40 + "афк до 18"
+    results = {}
+    for name, parse in (("grammar", parse_time_to_minutes), ("cascade", cascade_parse_time_to_minutes)):
+        for case, texts in (("commands", commands), ("long_until", [long_message] * 10)):
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for text in texts:
+                    parse_cache.clear()
+                    call_started = time.perf_counter()
+                    parse(text)
+                    latencies.append(time.perf_counter() - call_started)
+            results[f"{name}_{case}"] = _summary(latencies, time.perf_counter() - started)
+    return results
+
+def bench_intake(bot, fake, corpus, timeout):
+    """События через фейковый Socket Mode: время до ack и до выполнения всех команд AFK"""
+    from slack_bolt import App
+
+    app = App(client=fake.client(), token_verification_enabled=False)
+    app.event("message")(bot.handle_message_events)
+    socket_mode = FakeSocketMode(app)
+    commands = sum(1 for text in corpus if parse_time_to_minutes(text))
+    sets_before = fake.calls["users.profile.set"]
+    latencies = []
+    started = time.perf_counter()
+    for index, text in enumerate(corpus):
+        event = {"type": "message", "user": f"UI{index}", "text": text, "channel": "CBENCH", "ts": f"{index}.0"}
+        latencies.append(socket_mode.deliver(event))
+    intake_elapsed = time.perf_counter() - started
+    drained = _wait_until(
+        lambda: fake.calls["users.profile.set"] - sets_before >= commands
+        and not bot.status_updates.pending() and not bot.slack_dispatcher.pending(),
+        timeout
+    )
+    return _summary(
+        latencies, intake_elapsed, afk_commands=commands,
+        drain_s=round(time.perf_counter() - started, 3), drained=drained
+    )
+
+def bench_modes(bot, fake, events, timeout):
+    """Синхронный (App + пул установки статусов) и асинхронный (AsyncApp + AsyncWebClient) режимы.
+
+    В каждый режим пачкой приходят events команд "афк 30" от разных
+    пользователей (профиль не в кэше: users.profile.get и users.profile.set).
+    Задержка - от доставки события до успешного users.profile.set на
+    фейковом Slack, события в секунду - по времени до последней установки.
+    """
+    import asyncio
+    from slack_bolt import App
+    from slack_bolt.request.async_request import AsyncBoltRequest
+    from slack_sdk.web.async_client import AsyncWebClient
+
+    def event_body(user_id, index):
+        event = {"type": "message", "user": user_id, "text": "афк 30", "channel": "CBENCH", "ts": f"{index}.0"}
+        return {"type": "event_callback", "team_id": "TBENCH", "event": event}
+
+    def result(delivered, started, drained):
+        lags = [fake.updated[user_id] - moment for user_id, moment in delivered.items() if user_id in fake.updated]
+        finished = max((fake.updated[user_id] for user_id in delivered if user_id in fake.updated), default=started)
+        for user_id in delivered:
+            bot.expiry_scheduler.cancel(user_id)
+        return _summary(lags, finished - started, drained=drained)
+
+    app = App(client=fake.client(), token_verification_enabled=False)
+    app.event("message")(bot.handle_message_events)
+    socket_mode = FakeSocketMode(app)
+    delivered = {}
+    started = time.time()
+    for index in range(events):
+        user_id = f"UMS{index}"
+        delivered[user_id] = time.time()
+        socket_mode.deliver(event_body(user_id, index)["event"])
+    drained = _wait_until(lambda: all(user_id in fake.updated for user_id in delivered), timeout)
+    results = {"sync": result(delivered, started, drained)}
+
+    async def run_async():
+        async_app = bot.create_async_app(AsyncWebClient(token="xoxp-bench", base_url=fake.base_url))
+        delivered = {}
+        started = time.time()
+        for index in range(events):
+            user_id = f"UMA{index}"
+            delivered[user_id] = time.time()
+            await async_app.async_dispatch(AsyncBoltRequest(body=event_body(user_id, index), mode="socket_mode"))
+        deadline = time.monotonic() + timeout
+        while not all(user_id in fake.updated for user_id in delivered) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return result(delivered, started, all(user_id in fake.updated for user_id in delivered))
+
+    results["async"] = asyncio.run(run_async())
+    return results
+
+def bench_status(bot, fake, users, workers):
+    """set_user_status для users пользователей из workers потоков (как пул установки статусов)"""
+    client = fake.client()
+    latencies = []
+
+    def set_status(index):
+        call_started = time.perf_counter()
+        bot.set_user_status(client, f"US{index}", 30, 30, team_id="TBENCH")
+        latencies.append(time.perf_counter() - call_started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(set_status, range(users)))
+    return _summary(
+        latencies, time.perf_counter() - started,
+        rate_limited=bot.slack_dispatcher.stats["rate_limited"],
+        emoji_failures=bot.emoji_resolver.stats["failed_calls"]
+    )
+
+def bench_profile_calls(bot, commands=1000, users=100, seed=0):
+    """Вызовы Web API на команду AFK: без кэша профилей (как раньше) и с ProfileCache.
+
+    commands команд от users пользователей в случайном порядке выполняются
+    set_user_status по очереди. В режиме no_cache запись пользователя
+    удаляется из кэша перед каждой командой, и users.profile.get
+    вызывается каждый раз; в режиме cached кэш работает как в боте. У
+    каждого режима свои пользователи, так что кэш в начале пуст.
+    """
+    fake = FakeSlack(latency=0.001)
+    client = fake.client()
+    rnd = random.Random(seed)
+    order = [rnd.randrange(users) for _ in range(commands)]
+    results = {}
+    try:
+        for mode in ("no_cache", "cached"):
+            before = Counter(fake.calls)
+            for index in order:
+                user_id = f"UP{mode}{index}"
+                if mode == "no_cache":
+                    bot.profile_cache.invalidate(user_id)
+                bot.set_user_status(client, user_id, 30, 30, team_id="TBENCH")
+            for index in set(order):
+                bot.expiry_scheduler.cancel(f"UP{mode}{index}")
+            gets = fake.calls["users.profile.get"] - before["users.profile.get"]
+            sets = fake.calls["users.profile.set"] - before["users.profile.set"]
+            results[mode] = {
+                "commands": commands,
+                "users": users,
+                "profile_get_per_command": round(gets / commands, 3),
+                "profile_set_per_command": round(sets / commands, 3),
+                "calls_per_command": round((gets + sets) / commands, 3),
+            }
+    finally:
+        fake.close()
+    return results
+
+def bench_clear(bot, fake, users, timeout):
+    """Очистка users статусов с одинаковым сроком: задержка от срока до ответа Slack"""
+    client = fake.client()
+    expiry = time.time() + 0.5
+    user_ids = [f"UC{index}" for index in range(users)]
+    for user_id in user_ids:
+        bot.user_statuses.set(user_id, expiry, 1, "TBENCH")
+    bot.expiry_scheduler.schedule_many(
+        [(user_id, expiry, bot.clear_status, (client, user_id, expiry)) for user_id in user_ids]
+    )
+    drained = _wait_until(lambda: all(user_id in fake.cleared for user_id in user_ids), timeout)
+    lags = [fake.cleared[user_id] - expiry for user_id in user_ids if user_id in fake.cleared]
+    elapsed = max(lags) if lags else 0
+    return _summary(lags, elapsed, drained=drained, slack_errors=fake.calls["errors"])
+
+def bench_restart(bot, fake, users):
+    """Перезапуск с users строками в SQLiteStatusStore: загрузка базы и восстановление очисток.
+
+    Статусы записываются одной транзакцией (flush), база закрывается и
+    открывается заново, как при старте бота; затем restore_pending_clears
+    кладёт все сроки в новый ExpiryScheduler через schedule_many. Сроки
+    в будущем, поэтому замер не зависит от фейкового Slack.
+    """
+    rnd = random.Random(0)
+    base = time.time()
+    user_ids = [f"UR{index}" for index in range(users)]
+    saved_statuses, saved_scheduler = bot.user_statuses, bot.expiry_scheduler
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "statuses.db")
+        store = bot.SQLiteStatusStore(path, flush_interval=3600)
+        for user_id in user_ids:
+            store.set(user_id, base + 600 + rnd.random() * 14400, 30, "TBENCH")
+        started = time.perf_counter()
+        store.close()
+        write_elapsed = time.perf_counter() - started
+        database_bytes = sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        )
+
+        started = time.perf_counter()
+        store = bot.SQLiteStatusStore(path, flush_interval=3600)
+        load_elapsed = time.perf_counter() - started
+        scheduler = bot.ExpiryScheduler()
+        bot.user_statuses, bot.expiry_scheduler = store, scheduler
+        try:
+            started = time.perf_counter()
+            bot.restore_pending_clears(fake.client())
+            restore_elapsed = time.perf_counter() - started
+            pending = scheduler.pending()
+            for user_id in user_ids:
+                scheduler.cancel(user_id)
+        finally:
+            bot.user_statuses, bot.expiry_scheduler = saved_statuses, saved_scheduler
+            store.close()
+    return {
+        "rows": users,
+        "restored": pending,
+        "database_mb": round(database_bytes / 2 ** 20, 1),
+        "write_s": round(write_elapsed, 3),
+        "load_s": round(load_elapsed, 3),
+        "restore_s": round(restore_elapsed, 3),
+        "restart_s": round(load_elapsed + restore_elapsed, 3),
+        **_process_stats(),
+    }
+
+def bench_rate_limit(bot, latency, rate_limit_rate, users, per_minute, timeout):
+    """Очистка users статусов, когда фейковый Slack отвечает 429 сверх per_minute вызовов users.profile.set.
+
+    Диспетчер работает с тем же лимитом, что и сервер. В случае at_limit
+    других ответов 429 нет, в случае storm каждый вызов дополнительно
+    получает 429 с вероятностью rate_limit_rate (не меньше 5%) и возвращается
+    в очередь до Retry-After. Очистки в секунду сравниваются с лимитом,
+    dropped - очистки, до которых так и не дошло.
+    """
+    results = {}
+    for case, storm_rate in (("at_limit", 0.0), ("storm", max(rate_limit_rate, 0.05))):
+        fake = FakeSlack(latency, rate_limit_rate=storm_rate, method_limits={"users.profile.set": (per_minute, 10)})
+        client = fake.client()
+        saved_dispatcher = bot.slack_dispatcher
+        bot.slack_dispatcher = bot.SlackDispatcher(limits={"users.profile.set": (per_minute, 5)})
+        try:
+            expiry = time.time() + 0.5
+            user_ids = [f"UL{case}{index}" for index in range(users)]
+            for user_id in user_ids:
+                bot.user_statuses.set(user_id, expiry, 1, "TBENCH")
+            bot.expiry_scheduler.schedule_many(
+                [(user_id, expiry, bot.clear_status, (client, user_id, expiry)) for user_id in user_ids]
+            )
+            drained = _wait_until(lambda: all(user_id in fake.cleared for user_id in user_ids), timeout)
+            lags = [fake.cleared[user_id] - expiry for user_id in user_ids if user_id in fake.cleared]
+            elapsed = max(lags) if lags else 0
+            stats = dict(bot.slack_dispatcher.stats)
+        finally:
+            bot.slack_dispatcher = saved_dispatcher
+            fake.close()
+        results[case] = _summary(
+            lags, elapsed, drained=drained, dropped=users - len(lags), limit_per_s=round(per_minute / 60, 1),
+            slack_429=fake.calls["ratelimited"], dispatcher_rate_limited=stats["rate_limited"]
+        )
+    return results
+
+def _cluster_node(node_id, nodes, path, base_url, texts, user_ids, ready, flushed, claim, results):
+    """Процесс-узел сценария cluster: бот с общим хранилищем (AFK_NODES) на фейковом Slack.
+
+    Получает свою долю сообщений (пользователи любые, чужие команды уходят
+    владельцу через общую базу), а по claim пытается очистить все статусы
+    в базе и сообщает, сколько очисток досталось ему.
+    """
+    os.environ.update(AFK_NODES=",".join(nodes), AFK_NODE_ID=node_id, AFK_STATUS_DB=path, AFK_STATUS_QUEUE="100000")
+    import afk_bot as bot
+    from slack_sdk import WebClient
+
+    configure_logging("CRITICAL")
+    bot.slack_dispatcher = bot.SlackDispatcher(
+        limits={method: (10 ** 6, 10 ** 4) for method in bot.SLACK_METHOD_LIMITS}, workers=16
+    )
+    store = bot.open_status_store()
+    client = WebClient(token="xoxp-bench", base_url=base_url)
+    bot.start_cluster_worker(client)
+    ready.wait()
+    for index, (user_id, text) in enumerate(texts):
+        event = {"type": "message", "user": user_id, "text": text, "channel": "CBENCH", "ts": f"{index}.0"}
+        bot.handle_message_events({"team_id": "TBENCH", "event": event}, client)
+
+    claim.wait()
+    owned = [user_id for user_id in user_ids if store.owns(user_id)]
+    _wait_until(lambda: all(store.get(user_id) is not None for user_id in owned), 60)
+    store.flush()
+    flushed.wait()
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT user_id, expiry FROM statuses").fetchall()
+    # Все узлы прочитали базу до первой очистки и пытаются очистить одни и те же статусы
+    flushed.wait()
+    results.put((node_id, len(rows), sum(store.claim_clear(user_id, expiry) for user_id, expiry in rows)))
+    store.close()
+
+def bench_cluster(fake, processes, users, seed, timeout):
+    """Масштабирование от 1 до N процессов бота с общим хранилищем статусов (SharedStatusStore).
+
+    Для каждого числа процессов users команд AFK от разных пользователей
+    делятся между узлами случайно, так что большая часть команд уходит
+    владельцу через общую базу. Меряются статусы в секунду до установки
+    последнего статуса на фейковом Slack и ускорение относительно одного
+    процесса. Затем каждый узел пытается очистить каждый статус из базы:
+    claimed должно совпасть с числом строк - каждая очистка ровно один раз.
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    rnd = random.Random(seed)
+    results = {}
+    for count in processes:
+        nodes = [f"node{index}" for index in range(count)]
+        user_ids = [f"UK{count}_{index}" for index in range(users)]
+        shares = [[] for _ in nodes]
+        for user_id in user_ids:
+            shares[rnd.randrange(count)].append((user_id, "афк 30"))
+        ready, flushed = context.Barrier(count + 1), context.Barrier(count)
+        claim, queue = context.Event(), context.Queue()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "statuses.db")
+            workers = [
+                context.Process(
+                    target=_cluster_node, daemon=True,
+                    args=(node_id, nodes, path, fake.base_url, share, user_ids, ready, flushed, claim, queue)
+                )
+                for node_id, share in zip(nodes, shares)
+            ]
+            for worker in workers:
+                worker.start()
+            ready.wait()
+            started = time.time()
+            drained = _wait_until(lambda: all(user_id in fake.updated for user_id in user_ids), timeout)
+            finished = max((fake.updated[user_id] for user_id in user_ids if user_id in fake.updated), default=started)
+            claim.set()
+            reports = [queue.get(timeout=timeout) for _ in workers]
+            for worker in workers:
+                worker.join(timeout)
+        elapsed = finished - started
+        results[str(count)] = {
+            "statuses_per_s": round(users / elapsed, 1) if elapsed else None,
+            "elapsed_s": round(elapsed, 3),
+            "drained": drained,
+            "rows": reports[0][1],
+            "claimed": sum(claimed for _, _, claimed in reports),
+        }
+    single = results.get("1", {}).get("statuses_per_s")
+    for result in results.values():
+        if single and result["statuses_per_s"]:
+            result["speedup"] = round(result["statuses_per_s"] / single, 2)
+    return results
+
+def bench_backfill(messages, workers_counts, afk_share, seed, chunk_mb=1):
+    """afk_backfill.backfill на синтетической выгрузке JSONL из messages сообщений.
+
+    Половина строк - сообщения, половина - события {"event": {...}}, как в
+    архиве событий. Файл разбирается с каждым числом процессов из
+    workers_counts; выводятся сообщения в минуту и ускорение относительно
+    первого прогона. Ускорение ограничено числом ядер (cpu_count).
+    """
+    from afk_backfill import backfill
+
+    results = {"cpu_count": os.cpu_count()}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.jsonl")
+        with open(path, "w", encoding="utf-8") as output:
+            for index, text in enumerate(generate_corpus(messages, afk_share, seed)):
+                message = {"type": "message", "user": f"UB{index % 500}", "text": text, "ts": f"{1700000000 + index}.0"}
+                record = {"event": dict(message, channel=f"C{index % 20}")} if index % 2 else message
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        results["file_mb"] = round(os.path.getsize(path) / 2 ** 20, 1)
+        first_rate = None
+        for workers in workers_counts:
+            started = time.perf_counter()
+            columns, stats = backfill(path, workers, chunk_mb)
+            elapsed = time.perf_counter() - started
+            rate = stats["messages"] / elapsed * 60
+            first_rate = first_rate or rate
+            results[f"workers_{workers}"] = {
+                "messages": stats["messages"],
+                "parsed": stats["parsed"],
+                "elapsed_s": round(elapsed, 3),
+                "messages_per_min": round(rate),
+                "speedup": round(rate / first_rate, 2),
+            }
+    return results
+
+def bench_scheduler(bot, users, timeout):
+    """ExpiryScheduler под users запланированными очистками.
+
+    Число потоков и память (tracemalloc) снимаются после планирования всех
+    статусов и после каждого из трёх раундов повторных команд AFK у всех
+    пользователей: при threading.Timer на статус оба числа росли бы с
+    каждой командой, здесь они ограничены. Затем
+    users задач с одним сроком выполняются, и меряется их опоздание;
+    часть из них перед сроком переносится или отменяется, и проверяется,
+    что каждая оставшаяся задача сработала ровно один раз, а отменённые
+    не сработали.
+    """
+    import gc
+    import tracemalloc
+
+    rnd = random.Random(0)
+    user_ids = [f"UE{index}" for index in range(users)]
+    threads_before = threading.active_count()
+
+    def noop():
+        pass
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        scheduler = bot.ExpiryScheduler()
+        base = time.time()
+        started = time.perf_counter()
+        for user_id in user_ids:
+            scheduler.schedule(user_id, base + 60 + rnd.random() * 14400, noop)
+        schedule_elapsed = time.perf_counter() - started
+        scheduled_memory = tracemalloc.get_traced_memory()[0]
+        threads_scheduled = threading.active_count()
+        # Повторные команды AFK: каждая задача заменяется новой
+        rescheduled_memory = []
+        threads_rescheduled = []
+        started = time.perf_counter()
+        for _ in range(3):
+            for user_id in user_ids:
+                scheduler.schedule(user_id, base + 60 + rnd.random() * 14400, noop)
+            rescheduled_memory.append(round(tracemalloc.get_traced_memory()[0] / 2 ** 20, 1))
+            threads_rescheduled.append(threading.active_count())
+        reschedule_elapsed = time.perf_counter() - started
+        pending = scheduler.pending()
+        for user_id in user_ids:
+            scheduler.cancel(user_id)
+    finally:
+        tracemalloc.stop()
+
+    fired = []
+    due = time.time() + 0.5
+    dues = dict.fromkeys(user_ids, due)
+
+    def fire(user_id):
+        fired.append((user_id, time.time()))
+
+    scheduler.schedule_many([(user_id, due, fire, (user_id,)) for user_id in user_ids])
+    # До срабатывания каждую десятую задачу переносим, а каждую десятую со сдвигом отменяем
+    for user_id in user_ids[::10]:
+        dues[user_id] = due + 0.1
+        scheduler.schedule(user_id, dues[user_id], fire, user_id)
+    cancelled = set(user_ids[5::10])
+    for user_id in cancelled:
+        scheduler.cancel(user_id)
+    expected = users - len(cancelled)
+    drained = _wait_until(lambda: len(fired) >= expected, timeout)
+    # Даём шанс сработать лишним вызовам: заменённым или отменённым задачам
+    time.sleep(0.2)
+    threads_firing = threading.active_count()
+    runs = Counter(user_id for user_id, _ in fired)
+    lags = [moment - dues[user_id] for user_id, moment in fired]
+    callbacks = {
+        "expected": expected,
+        "ran_once": sum(1 for user_id, count in runs.items() if count == 1 and user_id not in cancelled),
+        "duplicates": sum(count - 1 for count in runs.values()),
+        "missing": sum(1 for user_id in user_ids if user_id not in cancelled and user_id not in runs),
+        "cancelled_ran": sum(1 for user_id in cancelled if user_id in runs),
+    }
+    callbacks["within_budget"] = (
+        callbacks["ran_once"] == expected and callbacks["duplicates"] == 0 and callbacks["cancelled_ran"] == 0
+    )
+    return {
+        "users": users,
+        "pending": pending,
+        "threads": {"before": threads_before, "scheduled": threads_scheduled,
+                    "rescheduled": threads_rescheduled, "firing": threads_firing},
+        "memory_mb": {"scheduled": round(scheduled_memory / 2 ** 20, 1), "rescheduled": rescheduled_memory},
+        "bytes_per_status": round(scheduled_memory / users, 1),
+        "schedule": {"count": users, "throughput_per_s": round(users / schedule_elapsed, 1)},
+        "reschedule": {"count": 3 * users, "throughput_per_s": round(3 * users / reschedule_elapsed, 1)},
+        "expiry": _summary(lags, max(lags) if lags else 0, drained=drained),
+        "callbacks": callbacks,
+    }
+
+def bench_table(bot, users, seed):
+    """StatusTable на users пользователях со сроками в ближайшие 8 часов.
+
+    Память на пользователя (tracemalloc) сравнивается со словарём словарей,
+    в котором статусы хранились раньше; строки user_id и сроки создаются до
+    замера и в него не входят. Выборка и очистка берут ~1% истёкших статусов.
+    """
+    import gc
+    import tracemalloc
+
+    rnd = random.Random(seed)
+    base = time.time()
+    horizon = 8 * 3600
+    user_ids = [f"UT{index}" for index in range(users)]
+    expiries = [base + rnd.random() * horizon for _ in range(users)]
+    moment = base + 0.01 * horizon
+
+    def traced_bytes(build):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            container = build()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return container, size
+
+    def build_dicts():
+        return {user_id: {"expiry": expiry, "minutes": 30, "team_id": None}
+                for user_id, expiry in zip(user_ids, expiries)}
+
+    def build_table():
+        table = bot.StatusTable()
+        for user_id, expiry in zip(user_ids, expiries):
+            table.set(user_id, expiry, 30)
+        return table
+
+    dicts, dict_bytes = traced_bytes(build_dicts)
+    del dicts
+    table, table_bytes = traced_bytes(build_table)
+    del table
+
+    started = time.perf_counter()
+    table = build_table()
+    set_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expired = table.expired_before(moment)
+    query_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    swept = table.pop_expired(moment)
+    sweep_ms = (time.perf_counter() - started) * 1000
+
+    # Замена срока у каждого десятого и отмена у каждого двадцатого: устаревшие элементы индекса
+    started = time.perf_counter()
+    for index in range(0, users, 10):
+        table.set(user_ids[index], expiries[index] + 600, 40)
+    for index in range(5, users, 20):
+        table.cancel(user_ids[index])
+    update_elapsed = time.perf_counter() - started
+    updates = len(range(0, users, 10)) + len(range(5, users, 20))
+
+    remaining = len(table)
+    started = time.perf_counter()
+    drained = table.drain()
+    drain_ms = (time.perf_counter() - started) * 1000
+
+    return {
+        "users": users,
+        "bytes_per_user": round(table_bytes / users, 1),
+        "dict_bytes_per_user": round(dict_bytes / users, 1),
+        "set": {"count": users, "throughput_per_s": round(users / set_elapsed, 1)},
+        "update": {"count": updates, "throughput_per_s": round(updates / update_elapsed, 1)},
+        "expired_before": {"count": len(expired), "elapsed_ms": round(query_ms, 2)},
+        "pop_expired": {"count": len(swept), "elapsed_ms": round(sweep_ms, 2),
+                        "us_per_status": round(sweep_ms * 1000 / len(swept), 3) if swept else None},
+        "drain": {"count": len(drained), "elapsed_ms": round(drain_ms, 2),
+                  "us_per_status": round(drain_ms * 1000 / remaining, 3) if remaining else None},
+        **_process_stats(),
+    }
+
+# Бюджет холодного запуска: процесс с импортом модуля (байт-код уже скомпилирован), медиана, мс
+IMPORT_BUDGETS_MS = {"afk_parser": 30, "afk_bot": 60}
+# Модули, которых не должно быть после импорта: их загружают только при запуске бота
+DEFERRED_MODULES = ("slack_bolt", "slack_sdk", "aiohttp", "asyncio", "http.server")
+
+# Цена метрик на событие в extract_afk_command, мкс
+METRICS_BUDGETS_US = {"non_afk": 0.25, "afk_command": 1.5}
+
+class _NullMetric:
+    """Счётчик или гистограмма, которые ничего не считают: так выглядит бот с выключенными метриками"""
+
+    def labels(self, *labelvalues):
+        return self
+
+    def inc(self, *labelvalues):
+        pass
+
+    def observe(self, value, *labelvalues):
+        pass
+
+def _timed_process(code, env, importtime=False):
+    """Время процесса python -c code, мс, и вывод -X importtime (stderr)"""
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    started = time.perf_counter()
+    completed = subprocess.run(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True, check=True)
+    return (time.perf_counter() - started) * 1000, completed.stderr
+
+def _imported_modules(importtime_output):
+    """{модуль: накопленное время импорта, мс} из вывода -X importtime"""
+    modules = {}
+    for line in importtime_output.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules[parts[2].strip()] = int(parts[1]) / 1000
+    return modules
+
+def bench_metrics(bot, corpus, repeat=7):
+    """Цена метрик в extract_afk_command: счётчики и гистограммы afk_bot выключены и включены.
+
+    Выключенные метрики заменяются _NullMetric, поэтому в этом замере
+    остаются только вызовы inc()/observe() без работы. Для каждого вида
+    событий берётся лучший из repeat проходов; разница на событие
+    сравнивается с METRICS_BUDGETS_US. Команды AFK разбираются с
+    прогретым кэшем, как повторяющиеся команды в работе.
+    """
+    metric_names = [
+        name for name, value in vars(bot).items()
+        if type(value).__module__ == "afk_metrics" and (hasattr(value, "inc") or hasattr(value, "observe"))
+    ]
+    enabled = {name: getattr(bot, name) for name in metric_names}
+    disabled = {name: _NullMetric() for name in metric_names}
+
+    def bodies(texts):
+        return [
+            {"event": {"type": "message", "user": f"UM{index}", "text": text, "channel": "CBENCH", "ts": f"{index}.0"}}
+            for index, text in enumerate(texts)
+        ]
+
+    events = {
+        "non_afk": bodies([text for text in corpus if not AFK_PREFILTER.search(text)]),
+        "afk_command": bodies([text for text in corpus if parse_time_to_minutes(text)]),
+    }
+    results = {}
+    for case, case_events in events.items():
+        best = {"disabled": float("inf"), "enabled": float("inf")}
+        for _ in range(repeat):
+            for mode, values in (("disabled", disabled), ("enabled", enabled)):
+                for name, value in values.items():
+                    setattr(bot, name, value)
+                try:
+                    started = time.perf_counter()
+                    for body in case_events:
+                        bot.extract_afk_command(body)
+                    elapsed = time.perf_counter() - started
+                finally:
+                    for name, value in enabled.items():
+                        setattr(bot, name, value)
+                best[mode] = min(best[mode], elapsed / max(len(case_events), 1))
+        overhead_us = (best["enabled"] - best["disabled"]) * 10 ** 6
+        results[case] = {
+            "events": len(case_events),
+            "disabled_us": round(best["disabled"] * 10 ** 6, 4),
+            "enabled_us": round(best["enabled"] * 10 ** 6, 4),
+            "overhead_us": round(overhead_us, 4),
+            "budget_us": METRICS_BUDGETS_US[case],
+            "within_budget": overhead_us <= METRICS_BUDGETS_US[case],
+        }
+    return results
+
+def bench_logging(bot, corpus, repeat=3):
+    """extract_afk_command на переписке без AFK: уровень INFO, уровень DEBUG и прежний print() на каждое сообщение.
+
+    Логи идут через ту же очередь и JSON-поток, что и в боте, но в os.devnull;
+    время включает вывод всех записей потоком QueueListener. Режим print
+    повторяет прежний обработчик: print(f"Сообщение: ...") до разбора.
+    """
+    import logging
+    import queue
+    from logging.handlers import QueueListener
+
+    events = [
+        {"event": {"type": "message", "user": f"UG{index}", "text": text, "channel": "CBENCH", "ts": f"{index}.0"}}
+        for index, text in enumerate(text for text in corpus if not AFK_PREFILTER.search(text))
+    ]
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    results = {}
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        for mode, level in (("info", logging.INFO), ("debug", logging.DEBUG), ("print", logging.INFO)):
+            best = float("inf")
+            for _ in range(repeat):
+                output = logging.StreamHandler(devnull)
+                output.setFormatter(JsonFormatter())
+                records = queue.SimpleQueue()
+                listener = QueueListener(records, output)
+                root.handlers[:] = [RecordQueueHandler(records)]
+                root.setLevel(level)
+                listener.start()
+                try:
+                    started = time.perf_counter()
+                    for body in events:
+                        if mode == "print":
+                            print(f"Сообщение: '{body['event']['text']}'", file=devnull)
+                        bot.extract_afk_command(body)
+                    listener.stop()
+                    best = min(best, time.perf_counter() - started)
+                finally:
+                    root.handlers[:] = saved_handlers
+                    root.setLevel(saved_level)
+            results[mode] = {
+                "events": len(events),
+                "per_event_us": round(best / max(len(events), 1) * 10 ** 6, 4),
+                "throughput_per_s": round(len(events) / best, 1),
+            }
+    return results
+
+def bench_importtime(runs=15):
+    """Холодный запуск процесса, импортирующего afk_parser или afk_bot, против IMPORT_BUDGETS_MS.
+
+    Импорт не должен открывать базу статусов: AFK_STATUS_DB указывает на
+    временный файл, который после импорта должен отсутствовать.
+    """
+    env = dict(os.environ)
+    # Бюджет задан для закэшированного байт-кода
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    results = {"interpreter_ms": round(statistics.median(_timed_process("pass", env)[0] for _ in range(runs)), 1)}
+    with tempfile.TemporaryDirectory() as directory:
+        status_db = os.path.join(directory, "statuses.db")
+        env["AFK_STATUS_DB"] = status_db
+        for module, budget_ms in IMPORT_BUDGETS_MS.items():
+            code = f"import {module}"
+            _timed_process(code, env)  # компиляция байт-кода
+            process_ms = statistics.median(_timed_process(code, env)[0] for _ in range(runs))
+            modules = _imported_modules(_timed_process(code, env, importtime=True)[1])
+            results[module] = {
+                "process_ms": round(process_ms, 1),
+                "import_ms": modules.get(module),
+                "budget_ms": budget_ms,
+                "within_budget": process_ms <= budget_ms,
+                "deferred_modules_loaded": sorted(name for name in modules if name in DEFERRED_MODULES),
+                "status_db_opened": os.path.exists(status_db),
+            }
+    return results
+
+def _budget_failures(scenarios, path=()):
+    """Пути к замерам, превысившим бюджет или загрузившим при импорте лишнее"""
+    failures = []
+    for key, value in scenarios.items():
+        if isinstance(value, dict):
+            if value.get("within_budget") is False or value.get("deferred_modules_loaded") or value.get("status_db_opened"):
+                failures.append(".".join(path + (key,)))
+            failures.extend(_budget_failures(value, path + (key,)))
+    return failures
+
+def compare(results, baseline, tolerance):
+    """Сравнить с сохранённым замером; возвращает список регрессий"""
+    regressions = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            old = previous.get(key) if isinstance(previous, dict) else None
+            if isinstance(value, dict):
+                walk(value, old, path + [key])
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(old, (int, float)) and old > 0:
+                change = (value - old) / old
+                worse = change < -tolerance if key == "throughput_per_s" else (
+                    change > tolerance if key in ("p50_ms", "p99_ms") else False
+                )
+                marker = "  РЕГРЕССИЯ" if worse else ""
+                print(f"{'.'.join(path + [key]):40} {old:>12} -> {value:<12} {change:+.1%}{marker}")
+                if worse:
+                    regressions.append(".".join(path + [key]))
+
+    if baseline.get("config") != results["config"]:
+        print("Внимание: параметры замера отличаются от сохранённых, сравнение может быть некорректным")
+    walk(results["scenarios"], baseline.get("scenarios", {}), [])
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочные замеры AFK-бота на фейковом Slack")
+    parser.add_argument("--scenarios", default="parse,intake,status,clear", help="сценарии через запятую")
+    parser.add_argument("--messages", type=int, default=20000, help="размер корпуса сообщений")
+    parser.add_argument("--afk-share", type=float, default=0.05, help="доля команд AFK в корпусе")
+    parser.add_argument("--users", type=int, default=500, help="пользователей в сценариях status, modes, clear и ratelimit")
+    parser.add_argument("--scheduler-users", type=int, default=100_000, help="статусов в сценарии scheduler")
+    parser.add_argument("--restart-users", type=int, default=100_000, help="строк в базе в сценарии restart")
+    parser.add_argument("--table-users", type=int, default=1_000_000, help="пользователей в сценарии table")
+    parser.add_argument("--backfill-messages", type=int, default=500_000, help="сообщений в выгрузке сценария backfill")
+    parser.add_argument("--backfill-workers", default="1,4", help="числа процессов в сценарии backfill через запятую")
+    parser.add_argument("--processes", default="1,2,4", help="числа процессов в сценарии cluster через запятую")
+    parser.add_argument("--cluster-users", type=int, default=2000, help="команд AFK в каждом прогоне сценария cluster")
+    parser.add_argument("--workers", type=int, default=4, help="потоков в сценарии status")
+    parser.add_argument("--latency-ms", type=float, default=20, help="задержка ответа фейкового Slack, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--limit-per-minute", type=int, default=3000,
+                        help="лимит users.profile.set фейкового Slack в сценарии ratelimit, вызовов в минуту")
+    parser.add_argument("--slack-limits", action="store_true",
+                        help="соблюдать лимиты Slack в диспетчере (по умолчанию сняты, чтобы мерить сам бот)")
+    parser.add_argument("--timeout", type=float, default=120, help="максимум ожидания очередей, с")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="CRITICAL", help="уровень логов бота во время замеров")
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранённым JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение при сравнении")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    import afk_bot as bot
+    configure_logging(args.log_level)
+    if not args.slack_limits:
+        bot.slack_dispatcher = bot.SlackDispatcher(
+            limits={method: (10 ** 6, 10 ** 4) for method in bot.SLACK_METHOD_LIMITS}, workers=16
+        )
+    fake = FakeSlack(args.latency_ms / 1000, args.error_rate, args.rate_limit_rate)
+    corpus = generate_corpus(args.messages, args.afk_share, args.seed)
+
+    scenarios = {}
+    for name in args.scenarios.split(","):
+        started = time.perf_counter()
+        if name == "parse":
+            scenarios[name] = bench_parse(corpus, seed=args.seed)
+        elif name == "prefilter":
+            scenarios[name] = bench_prefilter(corpus)
+        elif name == "typos":
+            scenarios[name] = bench_typos(corpus, args.seed)
+        elif name == "grammar":
+            scenarios[name] = bench_grammar(corpus)
+        elif name == "intake":
+            scenarios[name] = bench_intake(bot, fake, corpus, args.timeout)
+        elif name == "modes":
+            scenarios[name] = bench_modes(bot, fake, args.users, args.timeout)
+        elif name == "status":
+            scenarios[name] = bench_status(bot, fake, args.users, args.workers)
+        elif name == "profile":
+            scenarios[name] = bench_profile_calls(bot, seed=args.seed)
+        elif name == "clear":
+            scenarios[name] = bench_clear(bot, fake, args.users, args.timeout)
+        elif name == "restart":
+            scenarios[name] = bench_restart(bot, fake, args.restart_users)
+        elif name == "ratelimit":
+            scenarios[name] = bench_rate_limit(bot, args.latency_ms / 1000, args.rate_limit_rate, args.users,
+                                               args.limit_per_minute, args.timeout)
+        elif name == "backfill":
+            scenarios[name] = bench_backfill(
+                args.backfill_messages, [int(count) for count in args.backfill_workers.split(",")], args.afk_share,
+                args.seed
+            )
+        elif name == "cluster":
+            scenarios[name] = bench_cluster(
+                fake, [int(count) for count in args.processes.split(",")], args.cluster_users, args.seed, args.timeout
+            )
+        elif name == "scheduler":
+            scenarios[name] = bench_scheduler(bot, args.scheduler_users, args.timeout)
+        elif name == "logging":
+            scenarios[name] = bench_logging(bot, corpus)
+        elif name == "metrics":
+            scenarios[name] = bench_metrics(bot, corpus)
+        elif name == "importtime":
+            scenarios[name] = bench_importtime()
+        elif name == "table":
+            scenarios[name] = bench_table(bot, args.table_users, args.seed)
+        else:
+            parser.error(f"неизвестный сценарий: {name}")
+        print(f"{name}: {json.dumps(scenarios[name], ensure_ascii=False)} ({time.perf_counter() - started:.1f} с)")
+    fake.close()
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("save", "compare", "log_level")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "scenarios": scenarios,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+    failures = _budget_failures(scenarios)
+    if failures:
+        print(f"Превышен бюджет: {', '.join(failures)}")
+        return 1
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"Регрессии: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,457 +1,1502 @@
 import os
-import re
 import time
-import datetime
+import heapq
+import bisect
+import hashlib
+import logging
+import sqlite3
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
 from dotenv import load_dotenv
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-from fuzzywuzzy import fuzz
+from afk_parser import AFK_PREFILTER, TIME_PATTERNS, parse_cache, parse_time_with_rule, warm_up_parse_cache, is_new_user_message
+from afk_logging import configure_logging
+from afk_metrics import registry as metrics, start_metrics_server
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the Slack app
-app = App(token=os.environ.get("SLACK_USER_TOKEN"))  # Используем user token
-
-# User status tracker
-user_statuses = {}
-
-# Предварительно скомпилированные регулярные выражения
-AFK_PATTERN = re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)', re.IGNORECASE)
-TIME_PATTERNS = {
-    'range': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*[-–—]\s*(\d+(?:[.,]\d+)?)', re.IGNORECASE),
-    'hours': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*(?:h|ч|час|часа|часов)', re.IGNORECASE),
-    'minutes': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*(?:m|min|мин|минут|минуты|минута|минуту)', re.IGNORECASE),
-    'half_hour': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(?:полчаса|half\s*hour)', re.IGNORECASE),
-    'hour_word': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(?:час|one\s*hour)', re.IGNORECASE),
-    'mix_1': re.compile(r'(?:еще|ещё|still|more)\s+(\d+)\s*(?:мин|min|m|минут|минуты|минута|минуту)', re.IGNORECASE),
-    'mix_2': re.compile(r'.*(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл).*?(\d+)[\s\-_]*(?:мин|min|m|минут|минуты|минута|минуту)', re.IGNORECASE),
-    'until_time': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл).*(?:до|until|till)\s+(\d{1,2})[:\.]?(\d{0,2})', re.IGNORECASE),
-    'simple_number': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)', re.IGNORECASE)
-}
+logger = logging.getLogger("afk_bot")
 
-# Кэш для быстрого распознавания общих команд
-COMMON_COMMANDS = {
-    # Простые числовые форматы
-    'afk 1': 60,  # 1 час = 60 минут
-    'afk 2': 120,  # 2 часа = 120 минут
-    'afk 3': 180,  # 3 часа = 180 минут
-    'afk 4': 240,  # 4 часа = 240 минут
-    'afk 5': 5,
-    'afk 10': 10,
-    'afk 15': 15,
-    'afk 20': 20,
-    'afk 30': 30,
-    'afk 40': 40,
-    'afk 45': 45,
-    'afk 50': 50,
-    'afk 60': 60,
-    'афк 1': 60,  # 1 час = 60 минут
-    'афк 2': 120,  # 2 часа = 120 минут
-    'афк 3': 180,  # 3 часа = 180 минут
-    'афк 4': 240,  # 4 часа = 240 минут
-    'афк 5': 5,
-    'афк 10': 10,
-    'афк 15': 15,
-    'афк 20': 20,
-    'афк 30': 30,
-    'афк 40': 40,
-    'афк 45': 45, 
-    'афк 50': 50,
-    'афк 60': 60,
-    'АФК 1': 60,  # 1 час = 60 минут
-    'АФК 20': 20,
-    'АФК 30': 30,
-    'АФК 40': 40,
-    'Афк 1': 60,  # 1 час = 60 минут
-    'Афк 20': 20,
-    'Афк 30': 30,
-    'Афк 40': 40,
-    
-    # С указанием времени
-    'афк час': 60,
-    'афк полчаса': 30,
-    'AFK час': 60,
-    'AFK полчаса': 30,
-    
-    # С буквой m/м
-    'afk 15m': 15,
-    'afk 20m': 20,
-    'afk 30m': 30,
-    'afk 40m': 40,
-    
-    # С буквой h/ч
-    'afk 1h': 60,
-    'афк 1ч': 60,
-    
-    # С явным указанием минут
-    'afk 10 мин': 10,
-    'afk 15 мин': 15,
-    'afk 20 мин': 20,
-    'afk 30 мин': 30,
-    'afk 40 мин': 40,
-    'афк 10 мин': 10,
-    'афк 15 мин': 15,
-    'афк 20 мин': 20,
-    'афк 30 мин': 30,
-    'афк 40 мин': 40,
-    'АФК 30 мин': 30,
-    
-    # С явным указанием часов
-    'afk 1 час': 60,
-    'афк 1 час': 60,
-    'Afk 1 час': 60,
-    
-    # Диапазоны
-    'afk 15-20': 20,
-    'afk 1-1.5': 90,
-    'афк 30-40': 40,
-    'афк 30-60': 60,
-    
-    # Другие форматы
-    'Еще 30 мин афк': 30
+# Метрики обработки событий и вызовов Slack (см. afk_metrics, AFK_METRICS_PORT)
+EVENTS_RECEIVED = metrics.counter("afk_events_received", "События message, полученные ботом")
+EVENTS_FILTERED = metrics.counter("afk_events_filtered", "События, отброшенные до разбора", ["reason"])
+COMMANDS_PARSED = metrics.counter("afk_messages_parsed", "Разобранные сообщения с AFK по сработавшему правилу", ["rule"])
+PARSE_LATENCY = metrics.histogram("afk_parse_seconds", "Время разбора сообщения с упоминанием AFK")
+SLACK_API_LATENCY = metrics.histogram("afk_slack_api_seconds", "Время вызова Slack Web API", ["method"])
+SLACK_API_ERRORS = metrics.counter("afk_slack_api_errors", "Ошибки вызовов Slack Web API", ["method", "error"])
+EMOJI_ATTEMPTS = metrics.counter("afk_status_emoji_attempts", "Попытки установить статус с эмодзи", ["outcome"])
+EMOJI_FALLBACKS = metrics.counter("afk_status_emoji_fallbacks", "Статусы, установленные не с первым по порядку эмодзи")
+STATUS_UPDATES = metrics.counter("afk_status_updates", "Команды AFK, переданные пулу установки статусов", ["outcome"])
+STATUS_QUEUE_WAIT = metrics.histogram("afk_status_queue_wait_seconds", "Ожидание команды AFK в очереди до начала установки статуса")
+# Дочерние метрики горячего пути, привязанные к меткам заранее
+_EVENTS_RECEIVED = EVENTS_RECEIVED.labels()
+_FILTERED_NOT_NEW = EVENTS_FILTERED.labels("not_new_message")
+_FILTERED_NO_AFK = EVENTS_FILTERED.labels("no_afk")
+_PARSE_LATENCY = PARSE_LATENCY.labels()
+
+def parse_workspace_tokens(value):
+    """AFK_WORKSPACE_TOKENS: "T01=xoxp-...,T02=xoxp-..." -> {team_id: user token}"""
+    tokens = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            team_id, _, token = item.partition("=")
+            tokens[team_id.strip()] = token.strip()
+    return tokens
+
+# User token для каждого рабочего пространства (если бот работает в нескольких)
+WORKSPACE_TOKENS = parse_workspace_tokens(os.environ.get("AFK_WORKSPACE_TOKENS"))
+
+def authorize_workspace(enterprise_id, team_id, logger):
+    """Bolt authorize: user token рабочего пространства, из которого пришло событие"""
+    from slack_bolt.authorization import AuthorizeResult
+
+    token = WORKSPACE_TOKENS.get(team_id)
+    if token is None:
+        return None
+    return AuthorizeResult(enterprise_id=enterprise_id, team_id=team_id, user_token=token)
+
+_workspace_clients = {}
+
+def workspace_client(team_id, default):
+    """Клиент Web API с токеном рабочего пространства team_id (того же класса, что default)"""
+    token = WORKSPACE_TOKENS.get(team_id)
+    if token is None:
+        return default
+    key = (type(default), team_id)
+    if key not in _workspace_clients:
+        _workspace_clients[key] = type(default)(token=token)
+    return _workspace_clients[key]
+
+class StatusRecord:
+    """Статус AFK одного пользователя: запись со слотами вместо словаря на каждого пользователя"""
+    __slots__ = ("expiry", "minutes", "team_id")
+
+    def __init__(self, expiry, minutes, team_id=None):
+        self.expiry = expiry
+        self.minutes = minutes
+        self.team_id = team_id
+
+    def __repr__(self):
+        return f"StatusRecord(expiry={self.expiry!r}, minutes={self.minutes!r}, team_id={self.team_id!r})"
+
+class StatusTable:
+    """Статусы пользователей с индексом по сроку истечения.
+
+    Записи StatusRecord хранятся по user_id, а min-куча (expiry, user_id)
+    позволяет найти статусы, истёкшие к моменту T, не перебирая всех
+    пользователей. Как в ExpiryScheduler, элементы кучи для заменённых и
+    отменённых статусов не удаляются сразу, а пропускаются; когда их
+    становится больше, чем живых, куча перестраивается. Блокировок нет -
+    их берёт хранилище.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._index = []
+
+    def __contains__(self, user_id):
+        return user_id in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, user_id):
+        return self._records.get(user_id)
+
+    def set(self, user_id, expiry, minutes, team_id=None):
+        """Установить или заменить статус; возвращает прежнюю запись или None"""
+        previous = self._records.get(user_id)
+        self._records[user_id] = StatusRecord(expiry, minutes, team_id)
+        if previous is None or previous.expiry != expiry:
+            heapq.heappush(self._index, (expiry, user_id))
+            self._compact_if_stale()
+        return previous
+
+    def cancel(self, user_id, expiry=None):
+        """Удалить статус (при заданном expiry - только если срок не менялся); True, если удалён"""
+        record = self._records.get(user_id)
+        if record is None or (expiry is not None and record.expiry != expiry):
+            return False
+        del self._records[user_id]
+        self._compact_if_stale()
+        return True
+
+    def expired_before(self, moment):
+        """Статусы со сроком раньше moment в порядке истечения, без удаления: [(user_id, запись)]"""
+        index = self._index
+        found = {}
+        # Обход кучи от корня: поддерево, корень которого не раньше moment, пропускается целиком
+        positions = [0] if index else []
+        while positions:
+            position = positions.pop()
+            expiry, user_id = index[position]
+            if expiry >= moment:
+                continue
+            record = self._records.get(user_id)
+            if record is not None and record.expiry == expiry:
+                found[user_id] = record
+            positions.extend(child for child in (2 * position + 1, 2 * position + 2) if child < len(index))
+        return sorted(found.items(), key=lambda item: item[1].expiry)
+
+    def pop_expired(self, moment):
+        """Удалить и вернуть статусы со сроком раньше moment в порядке истечения"""
+        expired = []
+        while self._index and self._index[0][0] < moment:
+            expiry, user_id = heapq.heappop(self._index)
+            record = self._records.get(user_id)
+            if record is not None and record.expiry == expiry:
+                del self._records[user_id]
+                expired.append((user_id, record))
+        return expired
+
+    def drain(self):
+        """Удалить и вернуть все статусы в порядке истечения (например, при остановке бота)"""
+        expired = sorted(self._records.items(), key=lambda item: item[1].expiry)
+        self._records = {}
+        self._index = []
+        return expired
+
+    def items(self):
+        return list(self._records.items())
+
+    def _compact_if_stale(self):
+        if len(self._index) > 2 * len(self._records) + 64:
+            self._index = [(record.expiry, user_id) for user_id, record in self._records.items()]
+            heapq.heapify(self._index)
+
+class MemoryStatusStore:
+    """Хранилище статусов в памяти процесса: user_id -> StatusRecord (в StatusTable)"""
+
+    def __init__(self):
+        self._statuses = StatusTable()
+        self._lock = threading.RLock()
+
+    def __contains__(self, user_id):
+        return user_id in self._statuses
+
+    def __len__(self):
+        return len(self._statuses)
+
+    def get(self, user_id):
+        return self._statuses.get(user_id)
+
+    def set(self, user_id, expiry, minutes, team_id=None):
+        with self._lock:
+            self._statuses.set(user_id, expiry, minutes, team_id)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._statuses.cancel(user_id)
+
+    def claim_clear(self, user_id, expiry):
+        """Забрать очистку статуса себе: True ровно для одного вызова, если статус не менялся"""
+        with self._lock:
+            return self._statuses.cancel(user_id, expiry)
+
+    def expired_before(self, moment):
+        """Статусы, истёкшие к моменту moment: [(user_id, StatusRecord)] по возрастанию срока"""
+        with self._lock:
+            return self._statuses.expired_before(moment)
+
+    def pop_expired(self, moment):
+        """Массово удалить из хранилища статусы, истёкшие к моменту moment, и вернуть их"""
+        with self._lock:
+            return self._statuses.pop_expired(moment)
+
+    def owns(self, user_id):
+        """Обрабатывает ли этот процесс команды пользователя (для одного процесса - всегда)"""
+        return True
+
+    def items(self):
+        with self._lock:
+            return self._statuses.items()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class SQLiteStatusStore(MemoryStatusStore):
+    """Хранилище статусов в SQLite (WAL), переживающее перезапуск бота.
+
+    Чтение идёт из копии в памяти, а изменения копятся и пишутся на диск
+    одной транзакцией раз в flush_interval секунд (или при flush()/close()).
+    Для каждого пользователя хранится только последняя операция. Соединение
+    используется только под _database_lock, а пачка, которую не удалось
+    записать, возвращается в очередь и пишется при следующем flush().
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        super().__init__()
+        self._database_lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS statuses ("
+            "user_id TEXT PRIMARY KEY, expiry REAL NOT NULL, minutes INTEGER NOT NULL, team_id TEXT"
+            ") WITHOUT ROWID"
+        )
+        # Базы, созданные до поддержки нескольких рабочих пространств
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(statuses)")}
+        if "team_id" not in columns:
+            self._connection.execute("ALTER TABLE statuses ADD COLUMN team_id TEXT")
+        self._connection.commit()
+        for user_id, expiry, minutes, team_id in self._connection.execute(
+            "SELECT user_id, expiry, minutes, team_id FROM statuses"
+        ):
+            if self.owns(user_id):
+                self._statuses.set(user_id, expiry, minutes, team_id)
+
+        self._pending = {}  # user_id -> (expiry, minutes, team_id) или None для удаления
+        self._flush_interval = flush_interval
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="afk-store-flush", daemon=True)
+        self._flusher.start()
+
+    def set(self, user_id, expiry, minutes, team_id=None):
+        with self._lock:
+            super().set(user_id, expiry, minutes, team_id)
+            self._pending[user_id] = (expiry, minutes, team_id)
+
+    def delete(self, user_id):
+        with self._lock:
+            super().delete(user_id)
+            self._pending[user_id] = None
+
+    def claim_clear(self, user_id, expiry):
+        with self._lock:
+            claimed = super().claim_clear(user_id, expiry)
+            if claimed:
+                self._pending[user_id] = None
+            return claimed
+
+    def pop_expired(self, moment):
+        with self._lock:
+            expired = super().pop_expired(moment)
+            for user_id, _ in expired:
+                self._pending[user_id] = None
+            return expired
+
+    def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        with self._database_lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        """Запись накопленных изменений; вызывается под _database_lock"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        upserts = [(user_id, *op) for user_id, op in pending.items() if op is not None]
+        deletes = [(user_id,) for user_id, op in pending.items() if op is None]
+        try:
+            with self._connection:
+                if upserts:
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO statuses (user_id, expiry, minutes, team_id) VALUES (?, ?, ?, ?)",
+                        upserts
+                    )
+                if deletes:
+                    self._connection.executemany("DELETE FROM statuses WHERE user_id = ?", deletes)
+        except Exception:
+            # Пачка не записана: возвращаем её, не затирая более новые операции
+            with self._lock:
+                for user_id, op in pending.items():
+                    self._pending.setdefault(user_id, op)
+            raise
+
+    def close(self):
+        self._closed.set()
+        self._flusher.join()
+        with self._database_lock:
+            self._write_pending()
+            self._connection.close()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Ошибка при сохранении статусов: %s", e)
+
+class HashRing:
+    """Консистентное хеширование ключей (user_id) по узлам с виртуальными точками на кольце.
+
+    При добавлении или удалении узла переезжает только ~1/N пользователей.
+    """
+
+    def __init__(self, nodes, replicas=128):
+        self.nodes = list(nodes)
+        points = sorted((self._hash(f"{node}#{index}"), node) for node in self.nodes for index in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+class SharedStatusStore(SQLiteStatusStore):
+    """Общее для нескольких процессов бота хранилище статусов (одна база SQLite на узле).
+
+    Пользователи распределены между узлами кольцом HashRing: узел держит в
+    памяти и обновляет только статусы своих пользователей, а команды чужих
+    пользователей передаёт владельцу через таблицу commands (forward /
+    take_commands), где на пользователя хранится только последняя команда.
+    Очистить статус может любой узел, но выполняет очистку только тот, чей
+    claim_clear удалил строку из базы, - поэтому каждая очистка происходит
+    ровно один раз, даже если владелец недоступен и её подобрал другой узел.
+    """
+
+    def __init__(self, path, node_id, ring, flush_interval=1.0):
+        self.node_id = node_id
+        self.ring = ring
+        super().__init__(path, flush_interval)
+        with self._database_lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS commands ("
+                "user_id TEXT PRIMARY KEY, node TEXT NOT NULL, team_id TEXT, "
+                "minutes INTEGER NOT NULL, original_minutes INTEGER, queued_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS commands_by_node ON commands (node)")
+
+    def owns(self, user_id):
+        return self.ring.node_for(user_id) == self.node_id
+
+    def claim_clear(self, user_id, expiry):
+        with self._database_lock:
+            # Сначала записываем свои изменения, чтобы база отражала последний статус
+            self._write_pending()
+            with self._connection:
+                claimed = self._connection.execute(
+                    "DELETE FROM statuses WHERE user_id = ? AND expiry = ?", (user_id, expiry)
+                ).rowcount == 1
+        with self._lock:
+            # Строка в базе уже удалена - убираем только копию в памяти
+            self._statuses.cancel(user_id, expiry)
+        return claimed
+
+    def expired_elsewhere(self, before):
+        """Статусы чужих пользователей, истёкшие до before: их владелец, видимо, недоступен"""
+        with self._database_lock:
+            rows = self._connection.execute(
+                "SELECT user_id, expiry, team_id FROM statuses WHERE expiry < ?", (before,)
+            ).fetchall()
+        return [row for row in rows if not self.owns(row[0])]
+
+    def forward(self, user_id, minutes, original_minutes=None, team_id=None):
+        """Передать команду AFK узлу-владельцу пользователя (заменяет его необработанную команду)"""
+        with self._database_lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO commands (user_id, node, team_id, minutes, original_minutes, queued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, self.ring.node_for(user_id), team_id, minutes, original_minutes, time.time())
+            )
+
+    def take_commands(self):
+        """Забрать команды, переданные этому узлу: [(user_id, minutes, original_minutes, team_id)]"""
+        with self._database_lock, self._connection:
+            return self._connection.execute(
+                "DELETE FROM commands WHERE node = ? RETURNING user_id, minutes, original_minutes, team_id",
+                (self.node_id,)
+            ).fetchall()
+
+def create_status_store(path=None, node_id=None, nodes=None):
+    """SQLite-хранилище, если задан путь к базе (AFK_STATUS_DB), иначе хранилище в памяти.
+
+    Если заданы узлы (AFK_NODES), хранилище общее для всех процессов бота.
+    """
+    if nodes:
+        if not path or node_id not in nodes:
+            raise ValueError("Для нескольких узлов нужны общая база AFK_STATUS_DB и AFK_NODE_ID из AFK_NODES")
+        return SharedStatusStore(path, node_id, HashRing(nodes))
+    if path:
+        return SQLiteStatusStore(path)
+    return MemoryStatusStore()
+
+# User status tracker: до запуска бота - хранилище в памяти, настроенное открывает open_status_store()
+user_statuses = MemoryStatusStore()
+
+def open_status_store():
+    """Открыть хранилище статусов по AFK_STATUS_DB, AFK_NODE_ID и AFK_NODES.
+
+    Вызывается при запуске, а не при импорте модуля: SQLite-хранилище
+    открывает базу, создаёт таблицы и запускает поток записи.
+    """
+    global user_statuses
+    user_statuses = create_status_store(
+        os.environ.get("AFK_STATUS_DB"),
+        os.environ.get("AFK_NODE_ID"),
+        [node.strip() for node in os.environ.get("AFK_NODES", "").split(",") if node.strip()]
+    )
+    return user_statuses
+
+class ExpiryScheduler:
+    """Один поток и min-куча сроков вместо отдельного threading.Timer на каждый статус.
+
+    Задачи адресуются ключом (user_id): повторное планирование заменяет
+    предыдущую задачу, cancel() снимает её. Отменённые записи удаляются
+    из кучи лениво, когда доходят до вершины.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, key, due, callback, *args):
+        """Запланировать callback(*args) на момент due (time.time()), заменив задачу с тем же ключом"""
+        with self._condition:
+            previous = self._entries.get(key)
+            if previous is not None:
+                previous[3] = None
+            self._counter += 1
+            entry = [due, self._counter, key, callback, args]
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            # Если отменённых записей накопилось больше половины, пересобираем кучу
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [item for item in self._heap if item[3] is not None]
+                heapq.heapify(self._heap)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="afk-expiry", daemon=True)
+                self._thread.start()
+            # Будим поток, только если новая задача стала ближайшей
+            if self._heap[0] is entry:
+                self._condition.notify()
+
+    def schedule_many(self, tasks):
+        """Запланировать пачку задач (key, due, callback, args) с одной пересборкой кучи"""
+        with self._condition:
+            for key, due, callback, args in tasks:
+                previous = self._entries.get(key)
+                if previous is not None:
+                    previous[3] = None
+                self._counter += 1
+                entry = [due, self._counter, key, callback, args]
+                self._entries[key] = entry
+                self._heap.append(entry)
+            heapq.heapify(self._heap)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="afk-expiry", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self, key):
+        """Отменить задачу по ключу. Возвращает True, если задача была запланирована"""
+        with self._condition:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            entry[3] = None
+            return True
+
+    def pending(self):
+        """Количество ожидающих истечения задач"""
+        with self._condition:
+            return len(self._entries)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    # Выбрасываем отменённые записи с вершины кучи
+                    while self._heap and self._heap[0][3] is None:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                due, _, key, callback, args = heapq.heappop(self._heap)
+                del self._entries[key]
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception("Ошибка в отложенной задаче для %s", key, extra={"key": str(key)})
+
+# Планировщик очистки статусов
+expiry_scheduler = ExpiryScheduler()
+
+class ProfileCache:
+    """Кэш текущего статуса пользователей в Slack: user_id -> (status_text, status_emoji).
+
+    Записи живут ttl секунд, при переполнении вытесняются самые давние (LRU).
+    Кэш обновляется после собственных вызовов users_profile_set и из событий
+    user_change / user_status_changed, поэтому users_profile_get нужен только
+    для отсутствующих или устаревших записей.
+    """
+
+    def __init__(self, ttl=300, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Статус из кэша или None, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, status_text, status_emoji):
+        state = (status_text or "", status_emoji or "")
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), state)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return state
+
+    def put_profile(self, user_id, profile):
+        """Запомнить статус из объекта profile Slack API"""
+        return self.put(user_id, profile.get("status_text"), profile.get("status_emoji"))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+# Кэш статусов пользователей в Slack
+profile_cache = ProfileCache()
+
+# Лимиты Web API по методам: (запросов в минуту, допустимый всплеск).
+# Значения соответствуют уровням (tier) из документации Slack.
+SLACK_METHOD_LIMITS = {
+    "users.profile.set": (50, 5),    # Tier 3
+    "users.profile.get": (100, 10),  # Tier 4
+    "chat.postMessage": (60, 1),     # ~1 сообщение в секунду
+    "emoji.list": (20, 2),           # Tier 2
 }
+DEFAULT_METHOD_LIMIT = (20, 2)
+
+# Приоритеты запросов: очистка статусов важнее установки, уведомления - в последнюю очередь
+PRIORITY_CLEAR = 0
+PRIORITY_STATUS = 1
+PRIORITY_NOTIFY = 2
+
+class CallSuperseded(Exception):
+    """Запрос заменён более новым запросом с тем же ключом до отправки в Slack"""
+
+class DispatcherOverloaded(Exception):
+    """Очередь диспетчера переполнена, запрос не принят"""
+
+class TokenBucket:
+    """Корзина токенов для одного метода Web API"""
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now):
+        """Момент (time.monotonic()), когда можно будет отправить следующий запрос"""
+        self._refill(now)
+        if self.blocked_until > now:
+            return self.blocked_until
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
 
-# Общий список слов, похожих на afk для быстрой проверки
-AFK_WORDS = {'afk', 'афк', 'аfk', 'afл', 'афл', 'аfл', 'аfк'}
+    def block(self, now, seconds):
+        """Ответ 429: ничего не отправлять seconds секунд"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
 
-def is_similar_to_afk(word):
-    """Быстрая проверка на сходство с AFK"""
-    word_lower = word.lower()
-    # Сначала проверяем точное совпадение (быстрее)
-    if word_lower in AFK_WORDS:
+class _DispatchRequest:
+    __slots__ = ("method", "key", "call", "future", "loop", "coalesce_key", "superseded")
+
+    def __init__(self, method, team_id, call, loop, coalesce_key):
+        self.method = method
+        self.key = (team_id, method)
+        self.call = call
+        self.future = Future()
+        self.loop = loop
+        self.coalesce_key = coalesce_key
+        self.superseded = False
+
+class SlackDispatcher:
+    """Единая точка для всех вызовов Slack Web API.
+
+    У каждого метода своя корзина токенов и своя очередь с приоритетами,
+    отдельные для каждого рабочего пространства (team_id): у токенов разных
+    пространств свои лимиты Slack. Ответ 429 блокирует метод в этом
+    пространстве на Retry-After секунд, а запрос возвращается в очередь на
+    прежнее место - очистки статусов не теряются. Ожидающие
+    запросы с одинаковым coalesce_key схлопываются: выполняется последний,
+    предыдущие завершаются CallSuperseded. При переполнении очереди
+    новые запросы отклоняются с DispatcherOverloaded, кроме очисток.
+
+    call может вернуть корутину (AsyncWebClient) - тогда она выполняется
+    в цикле событий вызывающего кода, а поток диспетчера не ждёт ответа:
+    число одновременных асинхронных вызовов ограничивают только корзины
+    токенов, а не число потоков.
+    """
+
+    def __init__(self, limits=None, workers=4, max_pending=1000):
+        self._limits = SLACK_METHOD_LIMITS if limits is None else limits
+        self._workers = workers
+        self.max_pending = max_pending
+        self._queues = {}
+        self._buckets = {}
+        self._coalesced = {}
+        self._pending = 0
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._threads = []
+        self.stats = {"dispatched": 0, "rate_limited": 0, "superseded": 0, "rejected": 0}
+
+    def submit(self, method, call, priority=PRIORITY_STATUS, coalesce_key=None, loop=None, team_id=None):
+        """Поставить вызов в очередь и вернуть concurrent.futures.Future с результатом"""
+        request = _DispatchRequest(method, team_id, call, loop, coalesce_key)
+        with self._condition:
+            previous = self._coalesced.get(coalesce_key) if coalesce_key is not None else None
+            if previous is not None:
+                previous.superseded = True
+                self._pending -= 1
+                self.stats["superseded"] += 1
+                previous.future.set_exception(CallSuperseded(method))
+            elif self._pending >= self.max_pending and priority != PRIORITY_CLEAR:
+                self.stats["rejected"] += 1
+                raise DispatcherOverloaded(method)
+            if coalesce_key is not None:
+                self._coalesced[coalesce_key] = request
+            if request.key not in self._queues:
+                self._queues[request.key] = []
+                self._buckets[request.key] = TokenBucket(*self._limits.get(method, DEFAULT_METHOD_LIMIT))
+            self._counter += 1
+            heapq.heappush(self._queues[request.key], (priority, self._counter, request))
+            self._pending += 1
+            if not self._threads:
+                for index in range(self._workers):
+                    thread = threading.Thread(target=self._run, name=f"afk-slack-{index}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            self._condition.notify()
+        return request.future
+
+    def call(self, method, call, priority=PRIORITY_STATUS, coalesce_key=None, team_id=None):
+        """Синхронный вызов через диспетчер"""
+        return self.submit(method, call, priority, coalesce_key, team_id=team_id).result()
+
+    async def call_async(self, method, call, priority=PRIORITY_STATUS, coalesce_key=None, team_id=None):
+        """Асинхронный вызов через диспетчер (call возвращает корутину)"""
+        import asyncio
+
+        future = self.submit(method, call, priority, coalesce_key, asyncio.get_running_loop(), team_id)
+        return await asyncio.wrap_future(future)
+
+    def pending(self):
+        with self._condition:
+            return self._pending
+
+    def _next_request(self):
+        """Запрос с наивысшим приоритетом среди очередей (пространство, метод), для которых есть токен"""
+        while True:
+            now = time.monotonic()
+            best = None
+            wake_at = None
+            for key, queue in self._queues.items():
+                while queue and queue[0][2].superseded:
+                    heapq.heappop(queue)
+                if not queue:
+                    continue
+                ready = self._buckets[key].ready_at(now)
+                if ready <= now:
+                    if best is None or queue[0][:2] < best[0][:2]:
+                        best = (queue[0], key)
+                elif wake_at is None or ready < wake_at:
+                    wake_at = ready
+            if best is not None:
+                item, key = best
+                heapq.heappop(self._queues[key])
+                self._buckets[key].take(now)
+                request = item[2]
+                if request.coalesce_key is not None and self._coalesced.get(request.coalesce_key) is request:
+                    del self._coalesced[request.coalesce_key]
+                return item
+            self._condition.wait(None if wake_at is None else wake_at - now)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                item = self._next_request()
+            request = item[2]
+            started = time.perf_counter()
+            try:
+                result = request.call()
+                if request.loop is not None:
+                    # Цикл событий есть только в асинхронном режиме, где asyncio уже загружен
+                    import asyncio
+                    if asyncio.iscoroutine(result):
+                        # Корутину выполняет цикл событий, запрос завершится в обратном вызове
+                        running = asyncio.run_coroutine_threadsafe(result, request.loop)
+                        running.add_done_callback(lambda done, item=item, started=started: self._finish_async(item, started, done))
+                        continue
+            except Exception as e:
+                self._finish(item, started, error=e)
+                continue
+            self._finish(item, started, result=result)
+
+    def _finish_async(self, item, started, done):
+        if done.cancelled():
+            self._finish(item, started, error=CancelledError())
+            return
+        error = done.exception()
+        self._finish(item, started, result=None if error is not None else done.result(), error=error)
+
+    def _finish(self, item, started, result=None, error=None):
+        """Завершить запрос: отдать результат или ошибку либо вернуть в очередь после 429"""
+        request = item[2]
+        SLACK_API_LATENCY.observe(time.perf_counter() - started, request.method)
+        if error is None:
+            with self._condition:
+                self._pending -= 1
+                self.stats["dispatched"] += 1
+            request.future.set_result(result)
+            return
+        retry_after = _retry_after(error)
+        SLACK_API_ERRORS.inc(request.method, "ratelimited" if retry_after is not None else _error_code(error))
+        if retry_after is None:
+            with self._condition:
+                self._pending -= 1
+            request.future.set_exception(error)
+            return
+        # Rate limit: блокируем метод в этом пространстве и возвращаем запрос на прежнее место в очереди
+        team_id = request.key[0]
+        with self._condition:
+            self.stats["rate_limited"] += 1
+            self._buckets[request.key].block(time.monotonic(), retry_after)
+            heapq.heappush(self._queues[request.key], item)
+            self._condition.notify_all()
+        logger.warning("Slack rate limit для %s, повтор через %s с", request.method, retry_after,
+                       extra={"method": request.method, "retry_after": retry_after, "team": team_id})
+
+def _retry_after(error):
+    """Retry-After в секундах, если ошибка - ответ 429 от Slack, иначе None"""
+    response = getattr(error, "response", None)
+    if response is None or getattr(response, "status_code", None) != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") or headers.get("retry-after") or 1
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 1.0
+
+def _error_code(error):
+    """Код ошибки Slack ("invalid_emoji" и т.п.) или имя класса исключения - для метрик"""
+    response = getattr(error, "response", None)
+    try:
+        code = response.get("error") if response is not None else None
+    except Exception:
+        code = None
+    return code or type(error).__name__
+
+# Диспетчер вызовов Slack Web API
+slack_dispatcher = SlackDispatcher()
+
+# Эмодзи статуса в порядке предпочтения: пробуем по очереди, пока один не сработает
+EMOJI_OPTIONS = [":afk:", ":zzz:", ":sleeping:", ":clock3:", ":coffee:"]
+# Эмодзи, которые есть не в каждом рабочем пространстве (их нужно добавить вручную)
+CUSTOM_EMOJI_OPTIONS = {":afk:"}
+
+class EmojiResolver:
+    """Запоминает первый сработавший эмодзи статуса для каждого рабочего пространства.
+
+    Пока эмодзи не выучен, перебираются все EMOJI_OPTIONS; после первого
+    успеха выученный эмодзи пробуется первым, и установка статуса стоит
+    ровно один вызов users_profile_set. Запись сбрасывается по событию
+    emoji_changed для одного из вариантов.
+    """
+
+    def __init__(self, options):
+        self.options = list(options)
+        self._learned = {}
+        self._lock = threading.Lock()
+        self.stats = {"learned_hits": 0, "failed_calls": 0, "saved_calls": 0}
+
+    def candidates(self, team_id=None):
+        """Эмодзи в порядке попыток: выученный первым"""
+        with self._lock:
+            learned = self._learned.get(team_id, self._learned.get(None))
+        if learned is None:
+            return list(self.options)
+        return [learned] + [emoji for emoji in self.options if emoji != learned]
+
+    def record_success(self, team_id, emoji, attempts):
+        with self._lock:
+            learned = self._learned.get(team_id, self._learned.get(None))
+            if emoji == learned and attempts == 1:
+                self.stats["learned_hits"] += 1
+                # Без кэша перед этим эмодзи были бы неудачные попытки со всеми предыдущими
+                self.stats["saved_calls"] += self.options.index(emoji)
+            self._learned[team_id] = emoji
+        EMOJI_ATTEMPTS.inc("success")
+        if emoji != self.options[0]:
+            EMOJI_FALLBACKS.inc()
+
+    def record_failure(self):
+        with self._lock:
+            self.stats["failed_calls"] += 1
+        EMOJI_ATTEMPTS.inc("failure")
+
+    def learn_from_emoji_list(self, custom_emoji, team_id=None):
+        """Выбрать эмодзи по ответу emoji.list, не тратя вызовы users_profile_set"""
+        for emoji in self.options:
+            if emoji not in CUSTOM_EMOJI_OPTIONS or emoji.strip(":") in custom_emoji:
+                with self._lock:
+                    self._learned[team_id] = emoji
+                return emoji
+        return None
+
+    def invalidate(self, team_id=None):
+        with self._lock:
+            self._learned.pop(team_id, None)
+            self._learned.pop(None, None)
+
+# Выученные эмодзи статуса
+emoji_resolver = EmojiResolver(EMOJI_OPTIONS)
+
+metrics.gauge("afk_tracked_statuses", "Статусы AFK в хранилище user_statuses", lambda: len(user_statuses))
+metrics.gauge("afk_pending_expiries", "Очистки статусов, ожидающие в планировщике", lambda: expiry_scheduler.pending())
+metrics.gauge("afk_slack_pending_calls", "Вызовы Slack в очереди диспетчера", lambda: slack_dispatcher.pending())
+metrics.gauge("afk_live_threads", "Живые потоки процесса (планировщик, диспетчер, пул статусов, запись в хранилище)",
+              threading.active_count)
+metrics.gauge("afk_status_queue_depth", "Команды AFK, ожидающие установки статуса", lambda: status_updates.pending())
+metrics.gauge("afk_parse_cache_entries", "Записи в кэше разбора", lambda: len(parse_cache))
+
+def format_status_text(minutes):
+    """Текст статуса AFK с правильным склонением"""
+    if minutes >= 60:
+        hours = minutes // 60
+        remaining_mins = minutes % 60
+        if remaining_mins == 0:
+            return f"AFK на {hours} {'час' if hours == 1 else 'часа' if 2 <= hours <= 4 else 'часов'}"
+        return f"AFK на {hours}:{remaining_mins:02d}"
+    return f"AFK на {minutes} {'минуту' if minutes == 1 else 'минуты' if 2 <= minutes % 10 <= 4 and (minutes < 10 or minutes > 20) else 'минут'}"
+
+def format_limit_notice(original_minutes):
+    """Текст уведомления о том, что запрошенное время было ограничено"""
+    return f"⚠️ Ваше запрошенное время AFK ({original_minutes} минут) было ограничено до 4 часов (240 минут)."
+
+def _forget_cleared_status(user_id, current_state):
+    """Если статус в Slack пустой, но бот считает что статус активен, сбрасываем отслеживание"""
+    current_status_text, current_status_emoji = current_state
+    if not current_status_text and not current_status_emoji and user_id in user_statuses:
+        user_statuses.delete(user_id)
+        expiry_scheduler.cancel(user_id)
+
+def _has_active_status(user_id, minutes):
+    """Проверяем, не установлен ли уже статус через бота"""
+    existing_status = user_statuses.get(user_id)
+    if existing_status and existing_status.expiry > time.time():
+        previous_minutes = existing_status.minutes
+        logger.info("Пользователь %s уже имеет статус AFK на %s минут. Заменяем на %s минут.",
+                    user_id, previous_minutes, minutes, extra={"user": user_id, "minutes": minutes})
         return True
-    # Потом используем более дорогую операцию нечеткого сравнения
-    return fuzz.ratio(word_lower, "afk") > 75 or fuzz.ratio(word_lower, "афк") > 75
+    return False
 
-def parse_time_to_minutes(message_text):
-    """Оптимизированный парсер времени из сообщения"""
-    
-    # Дополнительный отладочный вывод для минут
-    debugging_minutes = "мин" in message_text.lower() or "min" in message_text.lower()
-    if debugging_minutes:
-        print(f"DEBUG: Начинаем парсинг времени для '{message_text}'")
-    
-    # Проверяем наличие в кэше часто используемых команд (самый быстрый путь)
-    message_lower = message_text.lower().strip()
-    if message_lower in COMMON_COMMANDS:
-        if debugging_minutes:
-            print(f"DEBUG: Найдено в кэше команд: {COMMON_COMMANDS[message_lower]} минут")
-        minutes = COMMON_COMMANDS[message_lower]
-        return (min(minutes, 240), minutes)  # (capped, original)
-    
-    # Проверяем наличие AFK в сообщении
-    if not AFK_PATTERN.search(message_text):
-        # Если AFK не найден, проверяем на опечатки только если сообщение короткое
-        words = message_lower.split()
-        if len(message_text) <= 30:  
-            # Для коротких сообщений проверяем каждое слово на сходство с AFK
-            for word in words:
-                if is_similar_to_afk(word):
-                    # Заменяем слово на афк для дальнейшего анализа
-                    message_text = message_text.replace(word, "афк")
-                    break
-        else:
-            return None  # Для длинных сообщений без явного AFK просто пропускаем
-    
-    # Сначала проверяем явные указания на минуты, часы и т.д.
-    
-    # Минуты: "афк 30m" or "афк 1 мин"
-    match = TIME_PATTERNS['minutes'].search(message_text)
-    if match:
-        minutes = float(match.group(1).replace(',', '.'))
-        if debugging_minutes:
-            print(f"DEBUG: Шаблон 'minutes' сработал: {minutes} минут")
-        return (min(int(minutes), 240), minutes)  # Ограничение в 4 часа
-    elif debugging_minutes:
-        print(f"DEBUG: Шаблон 'minutes' НЕ сработал")
-        
-        # Ручная проверка регулярного выражения для отладки
-        import re
-        pattern = r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*(?:m|min|мин|минут|минуты|минута|минуту)'
-        manual_match = re.search(pattern, message_text, re.IGNORECASE)
-        if manual_match:
-            print(f"DEBUG: Ручная проверка шаблона успешна: {manual_match.group(1)}")
-        else:
-            print(f"DEBUG: Ручная проверка шаблона НЕ успешна")
-            print(f"DEBUG: Проверяем части выражения:")
-            
-            # Проверка наличия AFK
-            afk_pattern = r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)'
-            if re.search(afk_pattern, message_text, re.IGNORECASE):
-                print(f"DEBUG: AFK найден в сообщении")
-            else:
-                print(f"DEBUG: AFK НЕ найден в сообщении")
-                
-            # Проверка формата числа
-            if re.search(r'\d+(?:[.,]\d+)?', message_text):
-                print(f"DEBUG: Число найдено в сообщении")
-            else:
-                print(f"DEBUG: Число НЕ найдено в сообщении")
-                
-            # Проверка минут
-            if re.search(r'(?:m|min|мин|минут|минуты|минута|минуту)', message_text, re.IGNORECASE):
-                print(f"DEBUG: Обозначение минут найдено в сообщении")
-            else:
-                print(f"DEBUG: Обозначение минут НЕ найдено в сообщении")
-    
-    # Часы: "афк 1h"
-    match = TIME_PATTERNS['hours'].search(message_text)
-    if match:
-        hours = float(match.group(1).replace(',', '.'))
-        minutes = int(hours * 60)
-        return (min(minutes, 240), minutes)  # Ограничение в 4 часа
-    
-    # Полчаса: "афк полчаса"
-    if TIME_PATTERNS['half_hour'].search(message_text):
-        return (30, 30)  # Не нужно ограничивать, меньше 4 часов
-    
-    # Час: "афк час"
-    if TIME_PATTERNS['hour_word'].search(message_text):
-        return (60, 60)  # Не нужно ограничивать, меньше 4 часов
-    
-    # Теперь проверяем более простые форматы
-    
-    # Проверяем простой формат "афк/afk число"
-    words = message_lower.split()
-    if len(words) >= 2:
-        for i, word in enumerate(words):
-            if word in AFK_WORDS and i + 1 < len(words) and words[i + 1].isdigit():
-                num = float(words[i + 1])
-                # Если число меньше 5, считаем часами
-                if num < 5:
-                    minutes = int(num * 60)
-                else:
-                    minutes = int(num)
-                return (min(minutes, 240), minutes)  # Ограничение в 4 часа
-    
-    # Проверка остальных шаблонов
-    
-    # Диапазон: "афк 1-1.5" или "афк 15-20"
-    match = TIME_PATTERNS['range'].search(message_text)
-    if match:
-        start, end = match.groups()
-        end = float(end.replace(',', '.'))
-        # Все числа в диапазоне считаем минутами
-        minutes = int(end)
-        # Ограничение: не более 4 часов (240 минут)
-        if minutes > 240:
-            minutes = 240
-        return (minutes, minutes)
-    
-    # Смешанный формат 1: "Еще 30 мин афк"
-    match = TIME_PATTERNS['mix_1'].search(message_text)
-    if match:
-        minutes = int(match.group(1))
-        return (min(minutes, 240), minutes)  # Ограничение в 4 часа
-    
-    # Смешанный формат 2: "Плохо себя чувствую. АФК минут 40"
-    match = TIME_PATTERNS['mix_2'].search(message_text)
-    if match:
-        minutes = int(match.group(1))
-        return (min(minutes, 240), minutes)  # Ограничение в 4 часа
-    
-    # До времени: "АФК до 12"
-    match = TIME_PATTERNS['until_time'].search(message_text)
-    if match:
-        hours = int(match.group(1))
-        minutes = 0
-        if match.group(2):
-            minutes = int(match.group(2))
-        
-        now = datetime.datetime.now()
-        target_time = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
-        
-        if target_time < now:
-            target_time += datetime.timedelta(days=1)
-        
-        diff = target_time - now
-        minutes = int(diff.total_seconds() / 60)
-        return (min(minutes, 240), minutes)  # Ограничение в 4 часа
-    
-    # Простое число: "афк 30"
-    match = TIME_PATTERNS['simple_number'].search(message_text)
-    if match:
-        num = float(match.group(1).replace(',', '.'))
-        # Если число меньше 5, считаем часами
-        if num < 5:
-            minutes = int(num * 60)
-        else:
-            minutes = int(num)
-        # Иначе считаем минутами
-        return (min(minutes, 240), minutes)  # Ограничение в 4 часа
-    
-    return None
+def _status_profile(status_text, emoji, expiry):
+    return {
+        "status_text": status_text,
+        "status_emoji": emoji,
+        "status_expiration": int(expiry)
+    }
+
+def _report_status_set(user_id, minutes, emoji, has_existing_afk):
+    action = "Обновлен" if has_existing_afk else "Установлен"
+    logger.info("%s статус AFK для пользователя %s на %s минут с эмодзи %s", action, user_id, minutes, emoji,
+                extra={"user": user_id, "minutes": minutes, "emoji": emoji})
+
+# Профиль для очистки статуса
+CLEARED_PROFILE = {
+    "status_text": "",
+    "status_emoji": "",
+    "status_expiration": 0
+}
+
+def send_limit_notice(client, user_id, original_minutes, loop=None, team_id=None):
+    """Отправить уведомление о лимите в 4 часа, не дожидаясь ответа Slack.
+
+    Уведомление идёт в очередь диспетчера с низшим приоритетом, а установка
+    статуса его не ждёт: результат только попадает в лог.
+    """
+    try:
+        future = slack_dispatcher.submit(
+            "chat.postMessage",
+            lambda: client.chat_postMessage(channel=user_id, text=format_limit_notice(original_minutes)),
+            priority=PRIORITY_NOTIFY,
+            loop=loop,
+            team_id=team_id
+        )
+    except DispatcherOverloaded as e:
+        logger.warning("Не удалось отправить уведомление о лимите: %s", e, extra={"user": user_id})
+        return
+    future.add_done_callback(lambda done: _finish_limit_notice(done, user_id))
 
-def set_user_status(client, user_id, minutes, original_minutes=None):
+def _finish_limit_notice(done, user_id):
+    if done.cancelled():
+        return
+    error = done.exception()
+    if error is not None:
+        logger.warning("Не удалось отправить уведомление о лимите: %s", error, extra={"user": user_id})
+
+def set_user_status(client, user_id, minutes, original_minutes=None, team_id=None):
     """Set user's status to AFK for the specified number of minutes"""
     
     # Если запрошенное время больше 4 часов, выводим сообщение о ограничении
     if original_minutes is not None and original_minutes > minutes:
+        send_limit_notice(client, user_id, original_minutes, team_id=team_id)
+    
+    # Проверяем текущий статус пользователя в Slack (запрос только если кэш устарел)
+    current_state = profile_cache.get(user_id)
+    if current_state is None:
         try:
-            client.chat_postMessage(
-                channel=user_id,
-                text=f"⚠️ Ваше запрошенное время AFK ({original_minutes} минут) было ограничено до 4 часов (240 минут)."
+            response = slack_dispatcher.call(
+                "users.profile.get", lambda: client.users_profile_get(user=user_id), team_id=team_id
             )
+            current_state = profile_cache.put_profile(user_id, response["profile"])
         except Exception as e:
-            print(f"Не удалось отправить уведомление о лимите: {e}")
+            logger.warning("Error checking current status: %s", e, extra={"user": user_id})
+    if current_state is not None:
+        _forget_cleared_status(user_id, current_state)
     
-    # Проверяем текущий статус пользователя в Slack
-    try:
-        current_profile = client.users_profile_get(user=user_id)
-        current_status_text = current_profile["profile"]["status_text"]
-        current_status_emoji = current_profile["profile"]["status_emoji"]
-        
-        # Если статус в Slack пустой, но бот считает что статус активен,
-        # сбрасываем отслеживание этого статуса
-        if not current_status_text and not current_status_emoji and user_id in user_statuses:
-            del user_statuses[user_id]
-    except Exception as e:
-        print(f"Error checking current status: {e}")
-    
-    # Проверяем, не установлен ли уже статус через бота
-    has_existing_afk = False
-    if user_id in user_statuses and user_statuses[user_id]["expiry"] > time.time():
-        # Status already set and not expired
-        has_existing_afk = True
-        previous_minutes = user_statuses[user_id]["minutes"]
-        print(f"Пользователь {user_id} уже имеет статус AFK на {previous_minutes} минут. Заменяем на {minutes} минут.")
+    has_existing_afk = _has_active_status(user_id, minutes)
     
     # Calculate expiry time
     expiry = time.time() + (minutes * 60)
-    
-    # Format minutes for display
-    if minutes >= 60:
-        hours = minutes // 60
-        remaining_mins = minutes % 60
-        if remaining_mins == 0:
-            status_text = f"AFK на {hours} {'час' if hours == 1 else 'часа' if 2 <= hours <= 4 else 'часов'}"
-        else:
-            status_text = f"AFK на {hours}:{remaining_mins:02d}"
-    else:
-        status_text = f"AFK на {minutes} {'минуту' if minutes == 1 else 'минуты' if 2 <= minutes % 10 <= 4 and (minutes < 10 or minutes > 20) else 'минут'}"
-    
-    # Пробуем использовать разные эмодзи по очереди, пока один не сработает
-    emoji_options = [":afk:", ":zzz:", ":sleeping:", ":clock3:", ":coffee:"]
+    status_text = format_status_text(minutes)
     
     success = False
     error_message = ""
     
-    for emoji in emoji_options:
+    for attempt, emoji in enumerate(emoji_resolver.candidates(team_id), 1):
+        profile = _status_profile(status_text, emoji, expiry)
         try:
-            client.users_profile_set(
-                user=user_id,
-                profile={
-                    "status_text": status_text,
-                    "status_emoji": emoji,
-                    "status_expiration": int(expiry)
-                }
+            # Повторы при rate limit выполняет диспетчер; сюда попадают только другие ошибки
+            slack_dispatcher.call(
+                "users.profile.set",
+                lambda: client.users_profile_set(user=user_id, profile=profile),
+                coalesce_key=("status", user_id),
+                team_id=team_id
             )
-            
-            if has_existing_afk:
-                print(f"Обновлен статус AFK для пользователя {user_id} на {minutes} минут с эмодзи {emoji}")
-            else:
-                print(f"Установлен статус AFK для пользователя {user_id} на {minutes} минут с эмодзи {emoji}")
-            
+            emoji_resolver.record_success(team_id, emoji, attempt)
+            profile_cache.put(user_id, status_text, emoji)
+            _report_status_set(user_id, minutes, emoji, has_existing_afk)
             success = True
             
             # Store status information
-            user_statuses[user_id] = {
-                "expiry": expiry,
-                "minutes": minutes
-            }
-            
-            # If there was an existing timer, we need to cancel it
-            # Since we can't easily cancel the timer, we'll just let it run and have it
-            # check the expected_expiry when it tries to clear
+            user_statuses.set(user_id, expiry, minutes, team_id)
             
-            # Schedule status cleanup
-            threading.Timer(minutes * 60, clear_status, args=[client, user_id, expiry]).start()
+            # Schedule status cleanup (replaces any pending cleanup for this user)
+            expiry_scheduler.schedule(user_id, expiry, clear_status, client, user_id, expiry, team_id)
             
             # Успешно установили статус, выходим из цикла
             break
             
+        except CallSuperseded:
+            logger.info("Статус AFK для пользователя %s заменен более новой командой", user_id, extra={"user": user_id})
+            return
+        except DispatcherOverloaded:
+            logger.error("Очередь запросов к Slack переполнена, статус AFK для %s не установлен", user_id,
+                         extra={"user": user_id})
+            return
         except Exception as e:
             error_message = str(e)
-            print(f"Ошибка при установке статуса с эмодзи {emoji}: {e}")
+            emoji_resolver.record_failure()
+            logger.warning("Ошибка при установке статуса с эмодзи %s: %s", emoji, e, extra={"user": user_id, "emoji": emoji})
             continue  # Пробуем следующий эмодзи
     
     if not success:
-        print(f"Не удалось установить статус AFK: {error_message}")
+        logger.error("Не удалось установить статус AFK: %s", error_message, extra={"user": user_id})
 
-def clear_status(client, user_id, expected_expiry):
+def clear_status(client, user_id, expected_expiry, team_id=None):
     """Clear the user's status if it hasn't been changed"""
-    if user_id in user_statuses and user_statuses[user_id]["expiry"] == expected_expiry:
-        # Status hasn't been updated, clear it
+    # Status hasn't been updated: claim the clear (exactly once across all nodes) and
+    # clear it without blocking the scheduler thread
+    if user_statuses.claim_clear(user_id, expected_expiry):
+        future = slack_dispatcher.submit(
+            "users.profile.set",
+            lambda: client.users_profile_set(user=user_id, profile=CLEARED_PROFILE),
+            priority=PRIORITY_CLEAR,
+            team_id=team_id
+        )
+        future.add_done_callback(lambda done: _finish_clear(done, user_id))
+
+def _finish_clear(done, user_id):
+    """Завершение очистки статуса после ответа Slack"""
+    error = done.exception()
+    if error is not None:
+        logger.error("Error clearing status: %s", error, extra={"user": user_id})
+        return
+    profile_cache.put(user_id, "", "")
+    logger.info("Статус AFK для пользователя %s удален по истечению времени", user_id, extra={"user": user_id})
+
+class StatusUpdatePool:
+    """Ограниченная очередь команд AFK и пул потоков, выполняющих set_user_status.
+
+    Обработчик события только разбирает сообщение и ставит команду в очередь,
+    поэтому медленные вызовы Web API не задерживают подтверждение и обработку
+    следующих событий. Очередь хранит не больше одной команды на пользователя:
+    новая команда заменяет ещё не начатую, и применяется только последняя.
+    Команды одного пользователя выполняются строго по очереди.
+
+    Политика перегрузки: когда ждут max_pending пользователей, команды
+    остальных пользователей отбрасываются (submit возвращает False), а
+    команды уже ждущих пользователей по-прежнему заменяют их предыдущие.
+    Очистки статусов идут через планировщик и диспетчер и не ограничиваются.
+    """
+
+    def __init__(self, workers=4, max_pending=1000):
+        self._workers = workers
+        self.max_pending = max_pending
+        self._order = deque()
+        self._commands = {}
+        self._active = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self.stats = {"queued": 0, "coalesced": 0, "dropped": 0}
+
+    def submit(self, client, user_id, minutes, original_minutes=None, team_id=None):
+        """Поставить команду в очередь; False, если очередь переполнена и команда отброшена"""
+        command = (client, user_id, minutes, original_minutes, team_id, time.monotonic())
+        with self._condition:
+            if user_id in self._commands:
+                self._commands[user_id] = command
+                outcome = "coalesced"
+            elif len(self._commands) >= self.max_pending:
+                outcome = "dropped"
+            else:
+                self._commands[user_id] = command
+                self._order.append(user_id)
+                outcome = "queued"
+                if not self._threads:
+                    for index in range(self._workers):
+                        thread = threading.Thread(target=self._run, name=f"afk-status-{index}", daemon=True)
+                        thread.start()
+                        self._threads.append(thread)
+                self._condition.notify()
+            self.stats[outcome] += 1
+        STATUS_UPDATES.inc(outcome)
+        if outcome == "dropped":
+            logger.error("Очередь установки статусов переполнена, команда AFK для %s отброшена", user_id,
+                         extra={"user": user_id, "minutes": minutes})
+            return False
+        return True
+
+    def pending(self):
+        with self._condition:
+            return len(self._commands)
+
+    def _next_command(self):
+        """Первая в очереди команда пользователя, статус которого сейчас не устанавливается"""
+        while True:
+            for index, user_id in enumerate(self._order):
+                if user_id not in self._active:
+                    del self._order[index]
+                    self._active.add(user_id)
+                    return self._commands.pop(user_id)
+            self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                client, user_id, minutes, original_minutes, team_id, queued_at = self._next_command()
+            STATUS_QUEUE_WAIT.observe(time.monotonic() - queued_at)
+            try:
+                set_user_status(client, user_id, minutes, original_minutes, team_id=team_id)
+            except Exception:
+                logger.exception("Ошибка при установке статуса AFK", extra={"user": user_id})
+            finally:
+                with self._condition:
+                    self._active.discard(user_id)
+                    if user_id in self._commands:
+                        # Пока статус устанавливался, пришла новая команда этого пользователя
+                        self._condition.notify_all()
+
+# Пул установки статусов между приёмом событий и вызовами Web API
+status_updates = StatusUpdatePool(
+    workers=int(os.environ.get("AFK_STATUS_WORKERS", 4)),
+    max_pending=int(os.environ.get("AFK_STATUS_QUEUE", 1000))
+)
+
+async def async_set_user_status(client, user_id, minutes, original_minutes=None, team_id=None):
+    """Асинхронная версия set_user_status для AsyncWebClient.
+
+    Уведомление о лимите отправляется в фоне, установка статуса его не ждёт.
+    """
+    import asyncio
+
+    if original_minutes is not None and original_minutes > minutes:
+        send_limit_notice(client, user_id, original_minutes, asyncio.get_running_loop(), team_id)
+
+    current_state = profile_cache.get(user_id)
+    if current_state is None:
         try:
-            client.users_profile_set(
-                user=user_id,
-                profile={
-                    "status_text": "",
-                    "status_emoji": "",
-                    "status_expiration": 0
-                }
+            response = await slack_dispatcher.call_async(
+                "users.profile.get", lambda: client.users_profile_get(user=user_id), team_id=team_id
             )
-            # Remove from tracking
-            del user_statuses[user_id]
-            print(f"Статус AFK для пользователя {user_id} удален по истечению времени")
+            current_state = profile_cache.put_profile(user_id, response["profile"])
         except Exception as e:
-            print(f"Error clearing status: {e}")
+            logger.warning("Error checking current status: %s", e, extra={"user": user_id})
+    if current_state is not None:
+        _forget_cleared_status(user_id, current_state)
+    
+    has_existing_afk = _has_active_status(user_id, minutes)
+    expiry = time.time() + (minutes * 60)
+    status_text = format_status_text(minutes)
+    error_message = ""
+    
+    for attempt, emoji in enumerate(emoji_resolver.candidates(team_id), 1):
+        profile = _status_profile(status_text, emoji, expiry)
+        try:
+            await slack_dispatcher.call_async(
+                "users.profile.set",
+                lambda: client.users_profile_set(user=user_id, profile=profile),
+                coalesce_key=("status", user_id),
+                team_id=team_id
+            )
+        except CallSuperseded:
+            logger.info("Статус AFK для пользователя %s заменен более новой командой", user_id, extra={"user": user_id})
+            return
+        except DispatcherOverloaded:
+            logger.error("Очередь запросов к Slack переполнена, статус AFK для %s не установлен", user_id,
+                         extra={"user": user_id})
+            return
+        except Exception as e:
+            error_message = str(e)
+            emoji_resolver.record_failure()
+            logger.warning("Ошибка при установке статуса с эмодзи %s: %s", emoji, e, extra={"user": user_id, "emoji": emoji})
+            continue
+        emoji_resolver.record_success(team_id, emoji, attempt)
+        profile_cache.put(user_id, status_text, emoji)
+        _report_status_set(user_id, minutes, emoji, has_existing_afk)
+        user_statuses.set(user_id, expiry, minutes, team_id)
+        expiry_scheduler.schedule(
+            user_id, expiry, _run_async_clear, asyncio.get_running_loop(), client, user_id, expiry, team_id
+        )
+        return
+    
+    logger.error("Не удалось установить статус AFK: %s", error_message, extra={"user": user_id})
 
-@app.event("message")
-def handle_message_events(body, client):
+async def async_clear_status(client, user_id, expected_expiry, team_id=None):
+    """Асинхронная версия clear_status для AsyncWebClient"""
+    import asyncio
+
+    if user_statuses.claim_clear(user_id, expected_expiry):
+        future = slack_dispatcher.submit(
+            "users.profile.set",
+            lambda: client.users_profile_set(user=user_id, profile=CLEARED_PROFILE),
+            priority=PRIORITY_CLEAR,
+            loop=asyncio.get_running_loop(),
+            team_id=team_id
+        )
+        try:
+            await asyncio.wrap_future(future)
+        except Exception:
+            pass  # Ошибку сообщит _finish_clear
+        _finish_clear(future, user_id)
+
+def _run_async_clear(loop, client, user_id, expected_expiry, team_id=None):
+    """Передать очистку статуса из потока планировщика в цикл событий"""
+    import asyncio
+
+    asyncio.run_coroutine_threadsafe(async_clear_status(client, user_id, expected_expiry, team_id), loop)
+
+def restore_pending_clears(client, loop=None):
+    """Восстановить запланированные очистки статусов из хранилища после перезапуска.
+
+    Уже истёкшие статусы получают срок в прошлом и очищаются сразу.
+    Если передан цикл событий, очистка выполняется через async_clear_status.
+    """
+    if loop is None:
+        tasks = [
+            (user_id, status.expiry, clear_status,
+             (workspace_client(status.team_id, client), user_id, status.expiry, status.team_id))
+            for user_id, status in user_statuses.items()
+        ]
+    else:
+        tasks = [
+            (user_id, status.expiry, _run_async_clear,
+             (loop, workspace_client(status.team_id, client), user_id, status.expiry, status.team_id))
+            for user_id, status in user_statuses.items()
+        ]
+    if tasks:
+        expiry_scheduler.schedule_many(tasks)
+    logger.info("Восстановлено отложенных очисток статуса: %s", len(tasks), extra={"pending": len(tasks)})
+
+# Как часто узел забирает переданные ему команды и ищет очистки недоступных узлов, секунды
+COMMAND_POLL_INTERVAL = 0.2
+ORPHAN_SWEEP_INTERVAL = 30.0
+# Через сколько секунд после срока чужой статус считается брошенным владельцем
+ORPHAN_GRACE = 60.0
+
+def route_afk_command(client, command, team_id=None):
+    """Выполнить команду на этом узле или передать её узлу-владельцу пользователя.
+
+    Возвращает True, если команду нужно выполнить здесь.
+    """
+    user_id, minutes, original_minutes = command
+    if user_statuses.owns(user_id):
+        return True
+    user_statuses.forward(user_id, minutes, original_minutes, team_id)
+    logger.debug("Команда AFK передана узлу %s", user_statuses.ring.node_for(user_id), extra={"user": user_id})
+    return False
+
+def start_cluster_worker(client, loop=None):
+    """Фоновый поток узла в режиме нескольких процессов (AFK_NODES)"""
+    thread = threading.Thread(target=_cluster_loop, args=(client, loop), name="afk-cluster", daemon=True)
+    thread.start()
+    return thread
+
+def _cluster_loop(client, loop):
+    """Забирать команды, переданные этому узлу, и подбирать очистки недоступных узлов"""
+    next_sweep = time.monotonic() + ORPHAN_SWEEP_INTERVAL
+    while True:
+        time.sleep(COMMAND_POLL_INTERVAL)
+        try:
+            for user_id, minutes, original_minutes, team_id in user_statuses.take_commands():
+                team_client = workspace_client(team_id, client)
+                if loop is None:
+                    status_updates.submit(team_client, user_id, minutes, original_minutes, team_id=team_id)
+                else:
+                    import asyncio
+                    asyncio.run_coroutine_threadsafe(
+                        async_set_user_status(team_client, user_id, minutes, original_minutes, team_id=team_id), loop
+                    )
+            if time.monotonic() < next_sweep:
+                continue
+            next_sweep = time.monotonic() + ORPHAN_SWEEP_INTERVAL
+            for user_id, expiry, team_id in user_statuses.expired_elsewhere(time.time() - ORPHAN_GRACE):
+                logger.info("Очистка статуса %s за недоступный узел", user_id, extra={"user": user_id})
+                team_client = workspace_client(team_id, client)
+                if loop is None:
+                    clear_status(team_client, user_id, expiry, team_id)
+                else:
+                    _run_async_clear(loop, team_client, user_id, expiry, team_id)
+        except Exception:
+            logger.exception("Ошибка обмена командами между узлами")
+
+def extract_afk_command(body):
+    """Отфильтровать событие сообщения и разобрать команду AFK.
+
+    Возвращает (user_id, capped_minutes, original_minutes) или None.
+    """
     # Process only new messages (not updates or deletions)
+    _EVENTS_RECEIVED.inc()
     event = body["event"]
-    
-    # Skip thread replies, edited messages, bot messages
-    if (event.get("thread_ts") or 
-        event.get("subtype") == "message_changed" or 
-        event.get("subtype") == "message_deleted" or
-        event.get("bot_id")):
-        return
+    if not is_new_user_message(event):
+        _FILTERED_NOT_NEW.inc()
+        return None
     
     user_id = event.get("user")
     message_text = event.get("text", "")
     
-    print(f"Сообщение: '{message_text}'")
+    # Отладочный вывод выполняется (и форматируется) только при уровне DEBUG
+    debugging = logger.isEnabledFor(logging.DEBUG)
+    if debugging:
+        logger.debug("Сообщение: '%s'", message_text, extra={"user": user_id})
     
     # Оптимизация: сначала быстрая проверка на наличие AFK в сообщении
-    if not any(word in message_text.lower() for word in AFK_WORDS) and not "afk" in message_text.lower() and not "афк" in message_text.lower():
+    if not AFK_PREFILTER.search(message_text):
         # Быстрая проверка не нашла упоминания AFK, пропускаем дальнейший анализ
-        return
+        _FILTERED_NO_AFK.inc()
+        return None
     
     # Отладочный вывод для проверки распознавания минут
-    if "мин" in message_text.lower() or "min" in message_text.lower():
-        print(f"Обнаружено указание на минуты в сообщении: '{message_text}'")
-        # Проверяем работу шаблона minutes
+    if debugging and ("мин" in message_text.lower() or "min" in message_text.lower()):
         match = TIME_PATTERNS['minutes'].search(message_text)
-        if match:
-            print(f"Шаблон 'minutes' сработал: найдено {match.group(1)} минут")
-        else:
-            print(f"Шаблон 'minutes' НЕ сработал для текста '{message_text}'")
+        logger.debug("Шаблон 'minutes' %s для текста '%s'", "сработал" if match else "НЕ сработал", message_text)
     
     # Parse time from message
-    result = parse_time_to_minutes(message_text)
+    started = time.perf_counter()
+    rule, result = parse_time_with_rule(message_text)
+    _PARSE_LATENCY.observe(time.perf_counter() - started)
+    COMMANDS_PARSED.inc(rule or "none")
+    if not result:
+        return None
     
-    if result:
-        capped_minutes, original_minutes = result
-        if capped_minutes < original_minutes:
-            print(f"Время ограничено: запрошено {original_minutes} мин, установлено {capped_minutes} мин")
-        else:
-            print(f"Время: {capped_minutes} минут")
-        set_user_status(client, user_id, capped_minutes, original_minutes)
+    capped_minutes, original_minutes = result
+    if capped_minutes < original_minutes:
+        logger.info("Время ограничено: запрошено %s мин, установлено %s мин", original_minutes, capped_minutes,
+                    extra={"user": user_id, "minutes": capped_minutes})
+    else:
+        logger.debug("Время: %s минут", capped_minutes, extra={"user": user_id, "minutes": capped_minutes})
+    return user_id, capped_minutes, original_minutes
+
+def update_profile_cache(body):
+    """Обновить кэш статусов из событий user_change / user_status_changed"""
+    user = body["event"].get("user")
+    if isinstance(user, dict) and user.get("id") and "profile" in user:
+        profile_cache.put_profile(user["id"], user["profile"])
+
+def handle_emoji_changed(body):
+    """Сбросить выученный эмодзи, если добавлен или удалён один из вариантов статуса"""
+    event = body["event"]
+    names = set(event.get("names") or [])
+    if event.get("name"):
+        names.add(event["name"])
+    if any(emoji.strip(":") in names for emoji in EMOJI_OPTIONS):
+        emoji_resolver.invalidate(body.get("team_id"))
+        logger.info("Эмодзи статуса изменены (%s), выбор эмодзи сброшен", ", ".join(sorted(names)))
+
+def probe_status_emoji(client):
+    """Один раз при запуске выбрать эмодзи статуса по списку эмодзи рабочего пространства"""
+    try:
+        response = slack_dispatcher.call("emoji.list", lambda: client.emoji_list())
+        logger.info("Эмодзи статуса: %s", emoji_resolver.learn_from_emoji_list(response["emoji"]))
+    except Exception as e:
+        logger.warning("Не удалось получить список эмодзи: %s", e)
+
+def handle_message_events(body, client):
+    command = extract_afk_command(body)
+    if command and route_afk_command(client, command, body.get("team_id")):
+        status_updates.submit(client, *command, team_id=body.get("team_id"))
+
+def handle_profile_events(body):
+    update_profile_cache(body)
+
+def handle_emoji_events(body):
+    handle_emoji_changed(body)
+
+def create_app():
+    """Синхронное приложение Bolt.
+
+    Создаётся при запуске, а не при импорте модуля: конструктор App проверяет
+    токен через auth.test, а сам slack_bolt импортируется заметное время.
+    """
+    from slack_bolt import App
+
+    if WORKSPACE_TOKENS:
+        sync_app = App(authorize=authorize_workspace)
+    else:
+        sync_app = App(token=os.environ.get("SLACK_USER_TOKEN"))  # Используем user token
+    sync_app.event("message")(handle_message_events)
+    sync_app.event("user_change")(handle_profile_events)
+    sync_app.event("user_status_changed")(handle_profile_events)
+    sync_app.event("emoji_changed")(handle_emoji_events)
+    return sync_app
+
+def create_async_app(client=None):
+    """Асинхронное приложение на AsyncApp/AsyncWebClient (требует aiohttp).
+
+    Каждое событие обрабатывается отдельной задачей, поэтому медленные
+    вызовы Web API не задерживают следующие сообщения. Готовый client
+    (например, с другим base_url) заменяет токен из окружения.
+    """
+    from slack_bolt.async_app import AsyncApp
+
+    if client is not None:
+        async_app = AsyncApp(client=client)
+    elif WORKSPACE_TOKENS:
+        async def authorize_workspace_async(enterprise_id, team_id, logger):
+            return authorize_workspace(enterprise_id, team_id, logger)
+
+        async_app = AsyncApp(authorize=authorize_workspace_async)
+    else:
+        async_app = AsyncApp(token=os.environ.get("SLACK_USER_TOKEN"))
+
+    @async_app.event("message")
+    async def handle_message_events_async(body, client):
+        command = extract_afk_command(body)
+        if command and route_afk_command(client, command, body.get("team_id")):
+            await async_set_user_status(client, *command, team_id=body.get("team_id"))
+
+    @async_app.event("user_change")
+    @async_app.event("user_status_changed")
+    async def handle_profile_events_async(body):
+        update_profile_cache(body)
+
+    @async_app.event("emoji_changed")
+    async def handle_emoji_events_async(body):
+        handle_emoji_changed(body)
+
+    return async_app
+
+async def run_async_bot():
+    """Запуск бота в асинхронном режиме (AFK_ASYNC_MODE=1)"""
+    import asyncio
+    from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+
+    async_app = create_async_app()
+    restore_pending_clears(async_app.client, asyncio.get_running_loop())
+    if isinstance(user_statuses, SharedStatusStore):
+        start_cluster_worker(async_app.client, asyncio.get_running_loop())
+    try:
+        response = await slack_dispatcher.call_async("emoji.list", lambda: async_app.client.emoji_list())
+        logger.info("Эмодзи статуса: %s", emoji_resolver.learn_from_emoji_list(response["emoji"]))
+    except Exception as e:
+        logger.warning("Не удалось получить список эмодзи: %s", e)
+    
+    handler = AsyncSocketModeHandler(async_app, os.environ.get("SLACK_APP_TOKEN"))
+    logger.info("⚡️ AFK бот запущен в асинхронном режиме!")
+    await handler.start_async()
 
 if __name__ == "__main__":
-    print(f"SLACK_USER_TOKEN: {os.environ.get('SLACK_USER_TOKEN') is not None}")
-    print(f"SLACK_APP_TOKEN: {os.environ.get('SLACK_APP_TOKEN') is not None}")
+    configure_logging(os.environ.get("AFK_LOG_LEVEL", "INFO").upper())
+    logger.info("SLACK_USER_TOKEN: %s", os.environ.get('SLACK_USER_TOKEN') is not None)
+    logger.info("SLACK_APP_TOKEN: %s", os.environ.get('SLACK_APP_TOKEN') is not None)
+    
+    # Метрики Prometheus на локальном порту
+    metrics_port = os.environ.get("AFK_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+        logger.info("Метрики доступны на http://127.0.0.1:%s/metrics", metrics_port)
     
-    handler = SocketModeHandler(app, os.environ.get("SLACK_APP_TOKEN"))
-    print("⚡️ AFK бот запущен!")
+    # Прогрев кэша разбора на корпусе реальных сообщений (по одному в строке)
+    warmup_corpus = os.environ.get("AFK_WARMUP_CORPUS")
+    if warmup_corpus:
+        with open(warmup_corpus, encoding="utf-8") as corpus:
+            logger.info("Кэш разбора прогрет на %s сообщениях", warm_up_parse_cache(corpus))
     
     try:
-        handler.start()
+        open_status_store()
+        if os.environ.get("AFK_ASYNC_MODE"):
+            import asyncio
+            
+            asyncio.run(run_async_bot())
+        else:
+            from slack_bolt.adapter.socket_mode import SocketModeHandler
+            
+            app = create_app()
+            restore_pending_clears(app.client)
+            if isinstance(user_statuses, SharedStatusStore):
+                start_cluster_worker(app.client)
+            probe_status_emoji(app.client)
+            
+            handler = SocketModeHandler(app, os.environ.get("SLACK_APP_TOKEN"))
+            logger.info("⚡️ AFK бот запущен!")
+            handler.start()
     except Exception as e:
-        print(f"Ошибка при запуске бота: {e}")
-        import traceback
-        traceback.print_exc() 
\ No newline at end of file
+        logger.exception("Ошибка при запуске бота: %s", e)
+    finally:
+        user_statuses.close()
@@ -0,0 +1,76 @@
+"""Структурированное логирование бота: JSON-записи через неблокирующую очередь.
+
+Обработчики событий только кладут запись в очередь (QueueHandler), а
+форматирование в JSON и вывод выполняет отдельный поток QueueListener.
+Уровень задаётся переменной окружения AFK_LOG_LEVEL (по умолчанию INFO).
+"""
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+# Атрибуты LogRecord, которые не относятся к полям из extra=
+_STANDARD_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON; поля из extra= попадают в запись как есть"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RecordQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в потоке вызова.
+
+    Стандартный prepare() форматирует сообщение вместе с трассировкой и
+    обнуляет exc_info, так что в JSON трассировка попадала бы внутрь
+    "message". Здесь в потоке вызова подставляются только аргументы
+    сообщения (они могут измениться, пока запись ждёт в очереди), а
+    трассировка сохраняется текстом в exc_text: объекты исключения и кадры
+    стека не должны передаваться в другой поток. JSON собирает QueueListener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener = None
+
+def configure_logging(level=None, stream=None):
+    """Подключить JSON-логирование через очередь к корневому логгеру (повторный вызов ничего не делает)"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [RecordQueueHandler(records)]
+    root.setLevel(level or "INFO")
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
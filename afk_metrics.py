@@ -0,0 +1,240 @@
+"""Метрики бота в формате Prometheus: счётчики, гистограммы и показатели.
+
+Метрики регистрируются в общем реестре registry. Текущие значения можно
+получить словарём (registry.snapshot()) или в текстовом формате Prometheus
+по HTTP (start_metrics_server, в боте - переменная AFK_METRICS_PORT).
+Внешних зависимостей нет; увеличение счётчика не берёт блокировок.
+"""
+import bisect
+import threading
+
+# Границы гистограмм задержек, секунды: от разбора сообщения до вызова Web API
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _ThreadCell(threading.local):
+    """Ячейка счётчика текущего потока; при создании регистрируется в общем списке ячеек"""
+
+    def __init__(self, cells, lock):
+        self.cell = [0]
+        with lock:
+            cells.append(self.cell)
+
+class _CounterChild:
+    """Значение счётчика для одного набора меток.
+
+    Каждый поток увеличивает свою ячейку, поэтому увеличение не требует
+    блокировки и не теряет значения при одновременных вызовах; value()
+    складывает ячейки всех потоков, в том числе уже завершившихся.
+    """
+    __slots__ = ("_cells", "_lock", "_local")
+
+    def __init__(self):
+        self._cells = []
+        self._lock = threading.Lock()
+        self._local = _ThreadCell(self._cells, self._lock)
+
+    def inc(self):
+        self._local.cell[0] += 1
+
+    def value(self):
+        with self._lock:
+            cells = list(self._cells)
+        return sum(cell[0] for cell in cells)
+
+class Counter:
+    """Монотонный счётчик с необязательными метками.
+
+    labels(*значения) возвращает дочерний счётчик с методом inc(); на горячем
+    пути его стоит получить один раз и сохранить.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, _CounterChild())
+        return child
+
+    def inc(self, *labelvalues):
+        self.labels(*labelvalues).inc()
+
+    def value(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        return child.value() if child is not None else 0
+
+    def snapshot(self):
+        with self._lock:
+            children = list(self._children.items())
+        return {labels: child.value() for labels, child in children}
+
+    def samples(self):
+        for labels, value in sorted(self.snapshot().items()):
+            yield self.name + "_total" + _format_labels(self.labelnames, labels), value
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_counts", "_sum", "_count", "_lock")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # Последняя корзина - значения выше всех границ
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self._buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            buckets[bound] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+class Histogram:
+    """Гистограмма с фиксированными границами; labels(*значения).observe(значение)"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, _HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value, *labelvalues):
+        self.labels(*labelvalues).observe(value)
+
+    def snapshot(self):
+        """{метки: {"buckets": {граница: накопленное число}, "sum": ..., "count": ...}}"""
+        with self._lock:
+            children = list(self._children.items())
+        return {labels: child.snapshot() for labels, child in children}
+
+    def samples(self):
+        for labels, data in sorted(self.snapshot().items()):
+            for bound, cumulative in data["buckets"].items():
+                yield self.name + "_bucket" + _format_labels(self.labelnames, labels, [("le", _format_value(bound))]), cumulative
+            yield self.name + "_sum" + _format_labels(self.labelnames, labels), data["sum"]
+            yield self.name + "_count" + _format_labels(self.labelnames, labels), data["count"]
+
+class Gauge:
+    """Показатель, значение которого вычисляется функцией в момент чтения"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = ()
+
+    def snapshot(self):
+        return {(): self.function()}
+
+    def samples(self):
+        yield self.name, self.function()
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, function):
+        return self._register(Gauge(name, documentation, function))
+
+    def snapshot(self):
+        """Текущие значения всех метрик: {имя: {кортеж значений меток: значение}}"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus (версия 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{sample} {_format_value(value)}" for sample, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+# Общий реестр метрик бота
+registry = MetricsRegistry()
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Отдавать метрики по http://host:port/metrics из фонового потока; возвращает сервер"""
+    # http.server импортируется только если метрики включены - он заметно замедляет запуск
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Не засоряем лог запросами Prometheus
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="afk-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,431 @@
+"""Разбор команд AFK из текста сообщений.
+
+Модуль не зависит от Slack: его используют и бот (afk_bot.py), и пакетная
+обработка выгрузок истории (afk_backfill.py).
+"""
+import re
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("afk_parser")
+
+# Предварительно скомпилированные регулярные выражения
+AFK_PATTERN = re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)', re.IGNORECASE)
+TIME_PATTERNS = {
+    'range': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*[-–—]\s*(\d+(?:[.,]\d+)?)', re.IGNORECASE),
+    'hours': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*(?:h|ч|час|часа|часов)', re.IGNORECASE),
+    'minutes': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*(?:m|min|мин|минут|минуты|минута|минуту)', re.IGNORECASE),
+    'half_hour': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(?:полчаса|half\s*hour)', re.IGNORECASE),
+    'hour_word': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(?:час|one\s*hour)', re.IGNORECASE),
+    'mix_1': re.compile(r'(?:еще|ещё|still|more)\s+(\d+)\s*(?:мин|min|m|минут|минуты|минута|минуту)', re.IGNORECASE),
+    'mix_2': re.compile(r'.*(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл).*?(\d+)[\s\-_]*(?:мин|min|m|минут|минуты|минута|минуту)', re.IGNORECASE),
+    'until_time': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл).*(?:до|until|till)\s+(\d{1,2})[:\.]?(\d{0,2})', re.IGNORECASE),
+    'simple_number': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)', re.IGNORECASE)
+}
+
+# Грамматика для однопроходного разбора: после каждого найденного AFK_PATTERN
+# хвост сообщения разбирается одним якорным выражением вместо каскада поисков.
+# Группы соответствуют правилам 'minutes', 'hours', 'range', 'simple_number',
+# 'half_hour' и 'hour_word' из TIME_PATTERNS.
+AFK_TAIL = re.compile(
+    r'\s+(?:(?P<number>\d+(?:[.,]\d+)?)\s*'
+    r'(?:(?P<minutes>m|мин)|(?P<hours>h|ч)|[-–—]\s*(?P<range_end>\d+(?:[.,]\d+)?)(?P<range_minutes>\s*(?:m|мин))?)?'
+    r'|(?P<half_hour>полчаса|half\s*hour)'
+    r'|(?P<hour_word>час|one\s*hour))',
+    re.IGNORECASE
+)
+# Хвосты правил 'mix_2' и 'until_time' без ведущего '.*' - применяются от конца найденного AFK
+MIX_2_TAIL = re.compile(r'.*?(\d+)[\s\-_]*(?:мин|min|m|минут|минуты|минута|минуту)', re.IGNORECASE)
+UNTIL_TIME_TAIL = re.compile(r'.*(?:до|until|till)\s+(\d{1,2})[:\.]?(\d{0,2})', re.IGNORECASE)
+
+# Выражения для отладочной диагностики правила 'minutes' (используются только при уровне DEBUG)
+DEBUG_NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)?')
+DEBUG_MINUTE_UNIT_PATTERN = re.compile(r'(?:m|min|мин|минут|минуты|минута|минуту)', re.IGNORECASE)
+
+# Порядок проверки правил - тот же, что и у прежнего каскада
+RULE_PRIORITY = {
+    'minutes': 0,
+    'hours': 1,
+    'half_hour': 2,
+    'hour_word': 3,
+    'range': 4,
+    'simple_number': 5,
+}
+
+class BoundedCache:
+    """Ограниченный по размеру LRU-кэш со статистикой попаданий, промахов и вытеснений"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._entries[key]
+            self.stats["misses"] += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Кэш результатов разбора по нормализованному тексту сообщения (заменяет ручную
+# таблицу частых команд: самые частые формулировки оседают в нём сами)
+parse_cache = BoundedCache(4096)
+# Кэш вердиктов нечёткого сравнения слов с AFK
+fuzzy_cache = BoundedCache(4096)
+
+# Правила, результат которых зависит от текущего времени и не кэшируется
+TIME_DEPENDENT_RULES = {'until_time'}
+
+_MISSING = object()
+
+# Общий список слов, похожих на afk для быстрой проверки
+AFK_WORDS = {'afk', 'афк', 'аfk', 'afл', 'афл', 'аfл', 'аfк'}
+
+def _build_afk_prefilter(words):
+    """Собирает из набора слов префиксное дерево и компилирует его в одно выражение.
+
+    Общие префиксы ("af", "аf", "аф") проверяются один раз, а опережающая
+    проверка первой буквы позволяет движку быстро пропускать остальной текст.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items())]
+        if len(branches) <= 1:
+            return ''.join(branches)
+        return '(?:' + '|'.join(branches) + ')'
+
+    first_chars = {word[0] for word in words} | {word[0].upper() for word in words}
+    lookahead = '(?=[' + ''.join(re.escape(char) for char in sorted(first_chars)) + '])'
+    return re.compile(lookahead + emit(trie), re.IGNORECASE)
+
+# Префильтр для входящих сообщений: все варианты из AFK_WORDS (включая смесь
+# кириллицы и латиницы) проверяются за один проход без lower() и без промежуточных строк
+AFK_PREFILTER = _build_afk_prefilter(AFK_WORDS)
+
+# Нечёткое сравнение с AFK: слово считается опечаткой, если fuzz.ratio с одной
+# из целей больше порога. Для fuzzywuzzy с python-Levenshtein ratio равен
+# 2 * LCS / (len(a) + len(b)), поэтому LCS считаем сами битово-параллельно
+AFK_TYPO_TARGETS = ("afk", "афк")
+AFK_TYPO_THRESHOLD = 75
+
+def _char_masks(target):
+    """Битовые маски позиций каждого символа цели"""
+    masks = {}
+    for index, char in enumerate(target):
+        masks[char] = masks.get(char, 0) | (1 << index)
+    return masks
+
+def _similarity_score(total_length, lcs):
+    """Та же формула и округление, что у fuzz.ratio"""
+    return int(round(100 * ((2 * lcs) / total_length)))
+
+_AFK_TYPO_MATCHERS = [(len(target), _char_masks(target)) for target in AFK_TYPO_TARGETS]
+# Длины слов, которые в принципе могут пройти порог (LCS не больше длины короче строки)
+_AFK_TYPO_LENGTHS = {
+    length
+    for target_length, _ in _AFK_TYPO_MATCHERS
+    for length in range(1, 4 * target_length)
+    if _similarity_score(length + target_length, min(length, target_length)) > AFK_TYPO_THRESHOLD
+}
+
+def _lcs_length(target_length, masks, word):
+    """Длина наибольшей общей подпоследовательности (алгоритм Хюрё, биты - позиции цели)"""
+    full = (1 << target_length) - 1
+    row = full
+    for char in word:
+        matched = row & masks.get(char, 0)
+        row = ((row + matched) | (row - matched)) & full
+    return target_length - bin(row).count("1")
+
+def _is_afk_typo(word):
+    for target_length, masks in _AFK_TYPO_MATCHERS:
+        lcs = _lcs_length(target_length, masks, word)
+        if _similarity_score(len(word) + target_length, lcs) > AFK_TYPO_THRESHOLD:
+            return True
+    return False
+
+def find_afk_typos(words):
+    """Пакетная проверка слов на сходство с AFK, возвращает список bool.
+
+    Повторы внутри пачки считаются один раз, слова неподходящей длины
+    отбрасываются без вычислений, остальные сверяются с fuzzy_cache.
+    """
+    verdicts = {}
+    result = []
+    for word in words:
+        word_lower = word.lower()
+        verdict = verdicts.get(word_lower)
+        if verdict is None:
+            # Сначала проверяем точное совпадение (быстрее)
+            if word_lower in AFK_WORDS:
+                verdict = True
+            elif len(word_lower) not in _AFK_TYPO_LENGTHS:
+                verdict = False
+            else:
+                verdict = fuzzy_cache.get(word_lower)
+                if verdict is None:
+                    verdict = _is_afk_typo(word_lower)
+                    fuzzy_cache.put(word_lower, verdict)
+            verdicts[word_lower] = verdict
+        result.append(verdict)
+    return result
+
+def is_similar_to_afk(word):
+    """Быстрая проверка на сходство с AFK"""
+    return find_afk_typos([word])[0]
+
+def _find_afk_anchors(message_text):
+    """Однократный проход по тексту: позиции всех упоминаний AFK"""
+    return list(AFK_PATTERN.finditer(message_text))
+
+def _classify_afk_tail(message_text, anchors):
+    """Разбирает хвост после каждого AFK и возвращает лучшее правило по приоритету каскада"""
+    best_rank = None
+    best_rule = None
+    best_tail = None
+    for anchor in anchors:
+        tail = AFK_TAIL.match(message_text, anchor.end())
+        if not tail:
+            continue
+        if tail.group('minutes'):
+            rule = 'minutes'
+        elif tail.group('hours'):
+            rule = 'hours'
+        elif tail.group('range_end'):
+            rule = 'range'
+        elif tail.group('number'):
+            rule = 'simple_number'
+        elif tail.group('half_hour'):
+            rule = 'half_hour'
+        else:
+            rule = 'hour_word'
+        rank = RULE_PRIORITY[rule]
+        # Среди одинаковых правил побеждает самое левое упоминание, как у search()
+        if best_rank is None or rank < best_rank:
+            best_rank, best_rule, best_tail = rank, rule, tail
+    return best_rule, best_tail
+
+def _match_mix_2(message_text, anchors):
+    """Смешанный формат 2 без ведущего '.*': последний AFK в первой подходящей строке"""
+    found = None
+    line_start = None
+    for anchor in anchors:
+        start = message_text.rfind('\n', 0, anchor.start())
+        if start != line_start:
+            if found:
+                return found
+            line_start = start
+        match = MIX_2_TAIL.match(message_text, anchor.end())
+        if match:
+            found = match
+    return found
+
+def _match_until_time(message_text, anchors):
+    """Формат "до 12": первый AFK, после которого в той же строке указано время"""
+    for anchor in anchors:
+        match = UNTIL_TIME_TAIL.match(message_text, anchor.end())
+        if match:
+            return match
+    return None
+
+def parse_time_to_minutes(message_text, now=None):
+    """Оптимизированный парсер времени из сообщения.
+
+    Вместо каскада из девяти регулярных выражений текст сканируется один раз
+    в поисках упоминаний AFK, а хвост после каждого из них разбирается одним
+    якорным выражением AFK_TAIL. Порядок правил (RULE_PRIORITY) совпадает
+    с прежним каскадом TIME_PATTERNS.
+
+    Результаты кэшируются по нормализованному тексту (parse_cache), кроме
+    правил, зависящих от текущего времени. now - момент отправки сообщения
+    для формата "до 12" (по умолчанию текущее время).
+    """
+    return parse_time_with_rule(message_text, now)[1]
+
+def parse_time_with_rule(message_text, now=None):
+    """Как parse_time_to_minutes, но возвращает (правило, результат); правило None, если разбор не удался"""
+    message_lower = message_text.lower().strip()
+    cached = parse_cache.get(message_lower, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    rule, result = _match_time(message_lower, now)
+    if rule not in TIME_DEPENDENT_RULES:
+        parse_cache.put(message_lower, (rule, result))
+    return rule, result
+
+def warm_up_parse_cache(messages):
+    """Прогреть кэши разбора на корпусе сообщений (например, выгрузке истории канала)"""
+    count = 0
+    for message in messages:
+        message = message.strip()
+        if message and AFK_PREFILTER.search(message):
+            parse_time_to_minutes(message)
+            count += 1
+    return count
+
+def _match_time(message_text, now=None):
+    """Разбор нормализованного текста: возвращает (правило, (capped, original)) или (None, None)"""
+    
+    # Дополнительный отладочный вывод для минут (проверка уровня - до любой работы со строкой)
+    debugging_minutes = logger.isEnabledFor(logging.DEBUG) and ("мин" in message_text or "min" in message_text)
+    if debugging_minutes:
+        logger.debug("Начинаем парсинг времени для '%s'", message_text)
+    
+    # Текст до исправления опечаток (для разбора по словам)
+    message_lower = message_text
+    
+    # Проверяем наличие AFK в сообщении
+    anchors = _find_afk_anchors(message_text)
+    if not anchors:
+        # Если AFK не найден, проверяем на опечатки только если сообщение короткое
+        words = message_lower.split()
+        if len(message_text) <= 30:  
+            # Для коротких сообщений проверяем все слова на сходство с AFK одной пачкой
+            for word, similar in zip(words, find_afk_typos(words)):
+                if similar:
+                    # Заменяем слово на афк для дальнейшего анализа
+                    message_text = message_text.replace(word, "афк")
+                    anchors = _find_afk_anchors(message_text)
+                    break
+        else:
+            return None, None  # Для длинных сообщений без явного AFK просто пропускаем
+    
+    rule, tail = _classify_afk_tail(message_text, anchors)
+    
+    # Сначала проверяем явные указания на минуты, часы и т.д.
+    
+    # Минуты: "афк 30m" or "афк 1 мин"
+    if rule == 'minutes':
+        minutes = float(tail.group('number').replace(',', '.'))
+        if debugging_minutes:
+            logger.debug("Шаблон 'minutes' сработал: %s минут", minutes)
+        return 'minutes', (min(int(minutes), 240), minutes)  # Ограничение в 4 часа
+    elif debugging_minutes:
+        # Диагностика: какая часть выражения не нашлась в сообщении
+        logger.debug(
+            "Шаблон 'minutes' НЕ сработал: AFK %s, число %s, обозначение минут %s",
+            "найден" if AFK_PATTERN.search(message_text) else "НЕ найден",
+            "найдено" if DEBUG_NUMBER_PATTERN.search(message_text) else "НЕ найдено",
+            "найдено" if DEBUG_MINUTE_UNIT_PATTERN.search(message_text) else "НЕ найдено",
+        )
+    
+    # Часы: "афк 1h"
+    if rule == 'hours':
+        hours = float(tail.group('number').replace(',', '.'))
+        minutes = int(hours * 60)
+        return 'hours', (min(minutes, 240), minutes)  # Ограничение в 4 часа
+    
+    # Полчаса: "афк полчаса"
+    if rule == 'half_hour':
+        return 'half_hour', (30, 30)  # Не нужно ограничивать, меньше 4 часов
+    
+    # Час: "афк час"
+    if rule == 'hour_word':
+        return 'hour_word', (60, 60)  # Не нужно ограничивать, меньше 4 часов
+    
+    # Теперь проверяем более простые форматы
+    
+    # Проверяем простой формат "афк/afk число"
+    words = message_lower.split()
+    if len(words) >= 2:
+        for i, word in enumerate(words):
+            if word in AFK_WORDS and i + 1 < len(words) and words[i + 1].isdigit():
+                num = float(words[i + 1])
+                # Если число меньше 5, считаем часами
+                if num < 5:
+                    minutes = int(num * 60)
+                else:
+                    minutes = int(num)
+                return 'words', (min(minutes, 240), minutes)  # Ограничение в 4 часа
+    
+    # Проверка остальных шаблонов
+    
+    # Диапазон: "афк 1-1.5" или "афк 15-20"
+    if rule == 'range':
+        end = float(tail.group('range_end').replace(',', '.'))
+        # Как и для простого числа, конец диапазона меньше 5 считаем часами ("афк 1-1.5"),
+        # если после него явно не указаны минуты ("афк 2-3 мин")
+        if end < 5 and not tail.group('range_minutes'):
+            minutes = int(end * 60)
+        else:
+            minutes = int(end)
+        # Ограничение: не более 4 часов (240 минут)
+        if minutes > 240:
+            minutes = 240
+        return 'range', (minutes, minutes)
+    
+    # Смешанный формат 1: "Еще 30 мин афк"
+    match = TIME_PATTERNS['mix_1'].search(message_text)
+    if match:
+        minutes = int(match.group(1))
+        return 'mix_1', (min(minutes, 240), minutes)  # Ограничение в 4 часа
+    
+    # Смешанный формат 2: "Плохо себя чувствую. АФК минут 40"
+    match = _match_mix_2(message_text, anchors)
+    if match:
+        minutes = int(match.group(1))
+        return 'mix_2', (min(minutes, 240), minutes)  # Ограничение в 4 часа
+    
+    # До времени: "АФК до 12"
+    match = _match_until_time(message_text, anchors)
+    if match:
+        hours = int(match.group(1))
+        minutes = 0
+        if match.group(2):
+            minutes = int(match.group(2))
+        
+        if now is None:
+            now = datetime.datetime.now()
+        target_time = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+        
+        if target_time < now:
+            target_time += datetime.timedelta(days=1)
+        
+        diff = target_time - now
+        minutes = int(diff.total_seconds() / 60)
+        return 'until_time', (min(minutes, 240), minutes)  # Ограничение в 4 часа
+    
+    # Простое число: "афк 30"
+    if rule == 'simple_number':
+        num = float(tail.group('number').replace(',', '.'))
+        # Если число меньше 5, считаем часами
+        if num < 5:
+            minutes = int(num * 60)
+        else:
+            minutes = int(num)
+        # Иначе считаем минутами
+        return 'simple_number', (min(minutes, 240), minutes)  # Ограничение в 4 часа
+    
+    return None, None
+
+def is_new_user_message(event):
+    """Только новые сообщения пользователей: без ответов в тредах, правок, удалений и ботов"""
+    return not (event.get("thread_ts") or
+                event.get("subtype") == "message_changed" or
+                event.get("subtype") == "message_deleted" or
+                event.get("bot_id"))
@@ -0,0 +1,159 @@
+"""Прежний парсер времени AFK (каскад TIME_PATTERNS и таблица COMMON_COMMANDS) - эталон для тестов.
+
+Здесь же прежняя быстрая проверка сообщений (mentions_afk), которую заменил AFK_PREFILTER.
+
+Код перенесён из afk_bot.py до перехода на afk_parser без изменений логики.
+Убран только отладочный вывод; fuzz.ratio заменён той же формулой, что
+у fuzzywuzzy с python-Levenshtein, а now позволяет зафиксировать время
+для формата "до 12".
+"""
+import re
+import datetime
+
+AFK_PATTERN = re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)', re.IGNORECASE)
+TIME_PATTERNS = {
+    'range': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*[-–—]\s*(\d+(?:[.,]\d+)?)', re.IGNORECASE),
+    'hours': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*(?:h|ч|час|часа|часов)', re.IGNORECASE),
+    'minutes': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)\s*(?:m|min|мин|минут|минуты|минута|минуту)', re.IGNORECASE),
+    'half_hour': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(?:полчаса|half\s*hour)', re.IGNORECASE),
+    'hour_word': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(?:час|one\s*hour)', re.IGNORECASE),
+    'mix_1': re.compile(r'(?:еще|ещё|still|more)\s+(\d+)\s*(?:мин|min|m|минут|минуты|минута|минуту)', re.IGNORECASE),
+    'mix_2': re.compile(r'.*(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл).*?(\d+)[\s\-_]*(?:мин|min|m|минут|минуты|минута|минуту)', re.IGNORECASE),
+    'until_time': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл).*(?:до|until|till)\s+(\d{1,2})[:\.]?(\d{0,2})', re.IGNORECASE),
+    'simple_number': re.compile(r'(?:афк|afk|АФК|AFK|афл|afл|аfк|аfл)\s+(\d+(?:[.,]\d+)?)', re.IGNORECASE)
+}
+
+COMMON_COMMANDS = {
+    'afk 1': 60, 'afk 2': 120, 'afk 3': 180, 'afk 4': 240, 'afk 5': 5, 'afk 10': 10, 'afk 15': 15,
+    'afk 20': 20, 'afk 30': 30, 'afk 40': 40, 'afk 45': 45, 'afk 50': 50, 'afk 60': 60,
+    'афк 1': 60, 'афк 2': 120, 'афк 3': 180, 'афк 4': 240, 'афк 5': 5, 'афк 10': 10, 'афк 15': 15,
+    'афк 20': 20, 'афк 30': 30, 'афк 40': 40, 'афк 45': 45, 'афк 50': 50, 'афк 60': 60,
+    'АФК 1': 60, 'АФК 20': 20, 'АФК 30': 30, 'АФК 40': 40,
+    'Афк 1': 60, 'Афк 20': 20, 'Афк 30': 30, 'Афк 40': 40,
+    'афк час': 60, 'афк полчаса': 30, 'AFK час': 60, 'AFK полчаса': 30,
+    'afk 15m': 15, 'afk 20m': 20, 'afk 30m': 30, 'afk 40m': 40,
+    'afk 1h': 60, 'афк 1ч': 60,
+    'afk 10 мин': 10, 'afk 15 мин': 15, 'afk 20 мин': 20, 'afk 30 мин': 30, 'afk 40 мин': 40,
+    'афк 10 мин': 10, 'афк 15 мин': 15, 'афк 20 мин': 20, 'афк 30 мин': 30, 'афк 40 мин': 40,
+    'АФК 30 мин': 30,
+    'afk 1 час': 60, 'афк 1 час': 60, 'Afk 1 час': 60,
+    'afk 15-20': 20, 'afk 1-1.5': 90, 'афк 30-40': 40, 'афк 30-60': 60,
+    'Еще 30 мин афк': 30
+}
+
+AFK_WORDS = {'afk', 'афк', 'аfk', 'afл', 'афл', 'аfл', 'аfк'}
+
+def mentions_afk(message_text):
+    """Быстрая проверка из handle_message_events до AFK_PREFILTER: подстроки AFK_WORDS в lower()"""
+    return (any(word in message_text.lower() for word in AFK_WORDS)
+            or "afk" in message_text.lower() or "афк" in message_text.lower())
+
+def fuzz_ratio(a, b):
+    """fuzz.ratio (fuzzywuzzy с python-Levenshtein): round(100 * 2 * LCS / (len(a) + len(b)))"""
+    if not a and not b:
+        return 0
+    previous = [0] * (len(b) + 1)
+    for char_a in a:
+        current = [0]
+        for index, char_b in enumerate(b):
+            current.append(previous[index] + 1 if char_a == char_b else max(previous[index + 1], current[index]))
+        previous = current
+    return int(round(100 * (2 * previous[-1] / (len(a) + len(b)))))
+
+def is_similar_to_afk(word):
+    word_lower = word.lower()
+    if word_lower in AFK_WORDS:
+        return True
+    return fuzz_ratio(word_lower, "afk") > 75 or fuzz_ratio(word_lower, "афк") > 75
+
+def parse_time_to_minutes(message_text, now=None):
+    message_lower = message_text.lower().strip()
+    if message_lower in COMMON_COMMANDS:
+        minutes = COMMON_COMMANDS[message_lower]
+        return (min(minutes, 240), minutes)
+
+    if not AFK_PATTERN.search(message_text):
+        words = message_lower.split()
+        if len(message_text) <= 30:
+            for word in words:
+                if is_similar_to_afk(word):
+                    message_text = message_text.replace(word, "афк")
+                    break
+        else:
+            return None
+
+    match = TIME_PATTERNS['minutes'].search(message_text)
+    if match:
+        minutes = float(match.group(1).replace(',', '.'))
+        return (min(int(minutes), 240), minutes)
+
+    match = TIME_PATTERNS['hours'].search(message_text)
+    if match:
+        hours = float(match.group(1).replace(',', '.'))
+        minutes = int(hours * 60)
+        return (min(minutes, 240), minutes)
+
+    if TIME_PATTERNS['half_hour'].search(message_text):
+        return (30, 30)
+
+    if TIME_PATTERNS['hour_word'].search(message_text):
+        return (60, 60)
+
+    words = message_lower.split()
+    if len(words) >= 2:
+        for i, word in enumerate(words):
+            if word in AFK_WORDS and i + 1 < len(words) and words[i + 1].isdigit():
+                num = float(words[i + 1])
+                if num < 5:
+                    minutes = int(num * 60)
+                else:
+                    minutes = int(num)
+                return (min(minutes, 240), minutes)
+
+    match = TIME_PATTERNS['range'].search(message_text)
+    if match:
+        start, end = match.groups()
+        end = float(end.replace(',', '.'))
+        minutes = int(end)
+        if minutes > 240:
+            minutes = 240
+        return (minutes, minutes)
+
+    match = TIME_PATTERNS['mix_1'].search(message_text)
+    if match:
+        minutes = int(match.group(1))
+        return (min(minutes, 240), minutes)
+
+    match = TIME_PATTERNS['mix_2'].search(message_text)
+    if match:
+        minutes = int(match.group(1))
+        return (min(minutes, 240), minutes)
+
+    match = TIME_PATTERNS['until_time'].search(message_text)
+    if match:
+        hours = int(match.group(1))
+        minutes = 0
+        if match.group(2):
+            minutes = int(match.group(2))
+
+        if now is None:
+            now = datetime.datetime.now()
+        target_time = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+
+        if target_time < now:
+            target_time += datetime.timedelta(days=1)
+
+        diff = target_time - now
+        minutes = int(diff.total_seconds() / 60)
+        return (min(minutes, 240), minutes)
+
+    match = TIME_PATTERNS['simple_number'].search(message_text)
+    if match:
+        num = float(match.group(1).replace(',', '.'))
+        if num < 5:
+            minutes = int(num * 60)
+        else:
+            minutes = int(num)
+        return (min(minutes, 240), minutes)
+
+    return None
@@ -0,0 +1,21 @@
+import json
+
+from afk_backfill import process_jsonl_lines
+
+def test_jsonl_skips_records_that_are_not_messages():
+    lines = [
+        "[1, 2]",
+        "42",
+        '"афк 30"',
+        "null",
+        "{not json",
+        json.dumps({"event": [1, 2]}),
+        json.dumps({"event": "афк 30"}),
+        json.dumps({"text": 30, "user": "U0"}),
+        json.dumps({"text": "афк 30", "user": "U1", "ts": "1700000000.0"}),
+        json.dumps({"event": {"type": "message", "text": "afk 2h", "user": "U2", "channel": "C1"}}),
+    ]
+    columns, stats = process_jsonl_lines(lines)
+    assert columns["user"] == ["U1", "U2"]
+    assert columns["capped"] == [30, 120]
+    assert stats["parsed"] == 2
@@ -0,0 +1,160 @@
+import time
+import asyncio
+
+from afk_bot import PRIORITY_STATUS, SlackDispatcher
+
+class RateLimited(Exception):
+    """Ошибка в форме SlackApiError с ответом 429"""
+
+    class Response(dict):
+        status_code = 429
+        headers = {"Retry-After": "0.05"}
+
+    def __init__(self):
+        super().__init__("ratelimited")
+        self.response = self.Response(error="ratelimited")
+
+def test_async_calls_do_not_hold_dispatcher_threads():
+    dispatcher = SlackDispatcher(limits={"users.profile.set": (10 ** 6, 10 ** 4)}, workers=2)
+    in_flight = peak = 0
+
+    async def slow_call():
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.1)
+        in_flight -= 1
+        return {"ok": True}
+
+    async def main():
+        return await asyncio.gather(*(
+            dispatcher.call_async("users.profile.set", slow_call, PRIORITY_STATUS) for _ in range(50)
+        ))
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    assert results == [{"ok": True}] * 50
+    assert peak == 50
+    assert time.perf_counter() - started < 1.0
+    assert dispatcher.pending() == 0
+
+def test_async_rate_limited_call_is_retried():
+    dispatcher = SlackDispatcher(limits={"users.profile.set": (10 ** 6, 10 ** 4)}, workers=1)
+    attempts = []
+
+    async def flaky_call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited()
+        return {"ok": True}
+
+    async def main():
+        return await dispatcher.call_async("users.profile.set", flaky_call)
+
+    assert asyncio.run(main()) == {"ok": True}
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.04
+    assert dispatcher.stats["rate_limited"] == 1
+
+class SlowNoticeClient:
+    """Клиент Web API, у которого chat.postMessage отвечает медленно"""
+
+    def __init__(self):
+        self.calls = []
+
+    def chat_postMessage(self, **kwargs):
+        time.sleep(0.5)
+        self.calls.append(("chat.postMessage", time.monotonic()))
+        return {"ok": True}
+
+    def users_profile_get(self, **kwargs):
+        self.calls.append(("users.profile.get", time.monotonic()))
+        return {"ok": True, "profile": {"status_text": "", "status_emoji": ""}}
+
+    def users_profile_set(self, **kwargs):
+        self.calls.append(("users.profile.set", time.monotonic()))
+        return {"ok": True}
+
+def test_limit_notice_does_not_delay_status(monkeypatch):
+    import afk_bot
+
+    monkeypatch.setattr(afk_bot, "slack_dispatcher", SlackDispatcher(
+        limits={method: (10 ** 6, 10 ** 4) for method in afk_bot.SLACK_METHOD_LIMITS}, workers=2
+    ))
+    client = SlowNoticeClient()
+    started = time.perf_counter()
+    afk_bot.set_user_status(client, "UNOTICE", 240, 300)
+    assert time.perf_counter() - started < 0.3
+    assert [method for method, _ in client.calls] == ["users.profile.get", "users.profile.set"]
+    afk_bot.expiry_scheduler.cancel("UNOTICE")
+    assert _wait(lambda: client.calls[-1][0] == "chat.postMessage")
+
+def test_async_limit_notice_does_not_delay_status(monkeypatch):
+    import afk_bot
+
+    monkeypatch.setattr(afk_bot, "slack_dispatcher", SlackDispatcher(
+        limits={method: (10 ** 6, 10 ** 4) for method in afk_bot.SLACK_METHOD_LIMITS}, workers=2
+    ))
+    noticed = []
+
+    class AsyncClient:
+        async def chat_postMessage(self, **kwargs):
+            await asyncio.sleep(0.5)
+            noticed.append(True)
+            return {"ok": True}
+
+        async def users_profile_get(self, **kwargs):
+            return {"ok": True, "profile": {"status_text": "", "status_emoji": ""}}
+
+        async def users_profile_set(self, **kwargs):
+            return {"ok": True}
+
+    async def main():
+        started = time.perf_counter()
+        await afk_bot.async_set_user_status(AsyncClient(), "UNOTICEA", 240, 300)
+        elapsed = time.perf_counter() - started
+        afk_bot.expiry_scheduler.cancel("UNOTICEA")
+        await asyncio.sleep(0.7)
+        return elapsed
+
+    assert asyncio.run(main()) < 0.3
+    assert noticed == [True]
+
+def _wait(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_rate_limit_blocks_only_its_workspace():
+    dispatcher = SlackDispatcher(limits={"users.profile.set": (10 ** 6, 10 ** 4)}, workers=2)
+    blocked_once = []
+
+    def limited_call():
+        if not blocked_once:
+            blocked_once.append(True)
+            raise RateLimitedFor(1.0)
+        return "A"
+
+    slow = dispatcher.submit("users.profile.set", limited_call, team_id="TA")
+    assert _wait(lambda: dispatcher.stats["rate_limited"] == 1)
+    started = time.monotonic()
+    assert dispatcher.call("users.profile.set", lambda: "B", team_id="TB") == "B"
+    assert time.monotonic() - started < 0.5
+    assert not slow.done()
+    assert slow.result(timeout=3) == "A"
+
+def test_workspaces_have_separate_buckets():
+    dispatcher = SlackDispatcher(limits={"users.profile.set": (60, 1)}, workers=2)
+    assert dispatcher.call("users.profile.set", lambda: "A1", team_id="TA") == "A1"
+    started = time.monotonic()
+    # Корзина TA пуста (1 запрос в секунду), а у TB свой токен и своя корзина
+    assert dispatcher.call("users.profile.set", lambda: "B1", team_id="TB") == "B1"
+    assert time.monotonic() - started < 0.5
+
+class RateLimitedFor(RateLimited):
+    def __init__(self, seconds):
+        super().__init__()
+        self.response.headers = {"Retry-After": str(seconds)}
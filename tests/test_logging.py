@@ -0,0 +1,24 @@
+import json
+import queue
+import logging
+
+from afk_logging import JsonFormatter, RecordQueueHandler
+
+def test_exception_is_a_separate_json_field():
+    records = queue.SimpleQueue()
+    logger = logging.getLogger("test_afk_logging")
+    logger.propagate = False
+    logger.addHandler(RecordQueueHandler(records))
+    try:
+        try:
+            raise RuntimeError("сбой")
+        except RuntimeError:
+            logger.exception("Ошибка для %s", "U1", extra={"user": "U1"})
+    finally:
+        logger.handlers.clear()
+
+    entry = json.loads(JsonFormatter().format(records.get_nowait()))
+    assert entry["message"] == "Ошибка для U1"
+    assert entry["user"] == "U1"
+    assert entry["exception"].startswith("Traceback")
+    assert "RuntimeError: сбой" in entry["exception"]
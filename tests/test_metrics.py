@@ -0,0 +1,23 @@
+import threading
+
+from afk_metrics import MetricsRegistry
+
+def test_counter_sums_increments_from_all_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter("afk_test_events", "События", ("reason",))
+    child = counter.labels("no_afk")
+
+    def work():
+        for _ in range(20000):
+            child.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    child.inc()
+    # Ячейки завершившихся потоков продолжают учитываться
+    assert counter.value("no_afk") == 8 * 20000 + 1
+    assert counter.value("other") == 0
+    assert 'afk_test_events_total{reason="no_afk"} 160001' in registry.render()
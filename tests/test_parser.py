@@ -0,0 +1,136 @@
+import re
+import random
+import datetime
+
+import pytest
+
+import baseline_parser
+from afk_bench import generate_corpus
+from afk_parser import AFK_PREFILTER, find_afk_typos, parse_cache, parse_time_to_minutes, parse_time_with_rule
+
+# Момент отправки для формата "до 12", одинаковый для обоих парсеров
+NOW = datetime.datetime(2026, 10, 17, 10, 20)
+
+README_EXAMPLES = [
+    "афк 1-1.5", "афк 30-60", "афк 0,5", "афк 1,5", "афк 1h", "афк 40m", "афк час", "AFK полчаса",
+    "афк 30 мин", "афк 40 минут", "Еще 30 мин афк", "Плохо себя чувствую. АФК минут 40",
+    "АФК по семейным до 12", "аfк 20", "афл 15", "afk 30", "афк 30", "AFK 2h", "афк 1.5 часа",
+    "афк полчаса", "Нужно отойти, афк 20 минут", "афк до 15:30",
+]
+# Токены для случайных сообщений: варианты и опечатки AFK, числа, единицы, служебные слова
+FUZZ_TOKENS = [
+    "афк", "AFK", "Афк", "afk", "аfк", "афл", "afл", "akf", "фак", "афкк", "af", "1", "2", "3", "4", "5",
+    "1.5", "0,5", "30", "45", "120", "300", "1-1.5", "2-4", "30-45", "-", "–", "m", "мин", "минут", "h",
+    "ч", "часа", "час",
+    "полчаса", "half hour", "one hour", "до", "until", "12", "15:30", "9.45", "еще", "still", "more",
+    "min", "по", "делам", ",", ".", "\n", "привет", "обед", "минуту",
+]
+
+MINUTE_UNIT = re.compile(r'\s*(?:m|мин)', re.IGNORECASE)
+def golden_corpus():
+    rnd = random.Random(1)
+    corpus = README_EXAMPLES + generate_corpus(20000, afk_share=0.5, seed=1)
+    for _ in range(30000):
+        separator = rnd.choice((" ", " ", " ", ""))
+        corpus.append(separator.join(rnd.choice(FUZZ_TOKENS) for _ in range(rnd.randint(1, 7))))
+    return corpus
+
+def range_reads_as_hours(text):
+    """Диапазон, который прежний парсер читал в минутах, а новый - в часах: конец меньше 5 без единиц"""
+    match = baseline_parser.TIME_PATTERNS['range'].search(text)
+    if match is None:
+        # Диапазон после исправленной опечатки AFK
+        for word in text.split():
+            if baseline_parser.is_similar_to_afk(word):
+                match = baseline_parser.TIME_PATTERNS['range'].search(text.replace(word, "афк"))
+                break
+    return (match is not None and float(match.group(2).replace(',', '.')) < 5
+            and not MINUTE_UNIT.match(match.string, match.end()))
+
+def parse_or_error(parse, text):
+    try:
+        return parse(text, NOW)
+    except ValueError:  # "до 25" - несуществующий час
+        return "error"
+
+@pytest.fixture(autouse=True)
+def empty_parse_cache():
+    parse_cache.clear()
+    yield
+    parse_cache.clear()
+
+@pytest.mark.parametrize("text, expected", [
+    # Конец диапазона меньше 5 без единиц - часы
+    ("afk 1-1.5", (90, 90)),
+    ("афк 1-2 часа", (120, 120)),
+    # Явно указанные минуты после диапазона - минуты, как у прежнего парсера
+    ("afk 2-4m", (4, 4)),
+    ("афк 2-3мин", (3, 3)),
+    ("afk 1-1.5 min", (1, 1)),
+    ("афк 3-4 минуты", (4, 4)),
+    # Диапазоны в минутах
+    ("afk 15-20", (20, 20)),
+    ("афк 30-60", (60, 60)),
+    ("афк 30-300", (240, 240)),
+])
+def test_range(text, expected):
+    assert parse_time_to_minutes(text) == expected
+
+def test_matches_baseline_parser():
+    """Однопроходная грамматика даёт те же результаты, что и прежний каскад TIME_PATTERNS.
+
+    Прежнему парсеру передаётся нормализованный текст (lower().strip()), с
+    которым работает новый. Единственное намеренное отличие - диапазон, который
+    заканчивается числом меньше 5 без указания минут, читается в часах
+    ("афк 1-1.5" - 90 минут).
+    """
+    mismatches = []
+    for text in golden_corpus():
+        text = text.lower().strip()
+        parse_cache.clear()
+        expected = parse_or_error(baseline_parser.parse_time_to_minutes, text)
+        actual = parse_or_error(parse_time_to_minutes, text)
+        if actual == expected:
+            continue
+        rule, _ = parse_time_with_rule(text, NOW)
+        if rule == "range" and range_reads_as_hours(text):
+            continue
+        mismatches.append((text, expected, actual))
+    assert mismatches == []
+
+def test_prefilter_accepts_same_messages_as_substring_check():
+    """AFK_PREFILTER пропускает те же сообщения, что и прежняя проверка подстрок после lower()"""
+    rnd = random.Random(2)
+    alphabet = "afkAFKафкАФКлЛlL Kİſ1 -"
+    messages = golden_corpus() + [
+        "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 12))) for _ in range(100000)
+    ]
+    mismatches = [text for text in messages if bool(AFK_PREFILTER.search(text)) != baseline_parser.mentions_afk(text)]
+    assert mismatches == []
+
+def ratio_verdict(word):
+    """Прежний вердикт is_similar_to_afk: fuzz.ratio с "afk" или "афк" больше 75"""
+    return baseline_parser.is_similar_to_afk(word)
+
+def test_afk_typos_match_ratio_threshold_exhaustively():
+    """Все строки длиной 1-5 над буквами целей и соседними символами обеих раскладок"""
+    alphabet = "afkафклlx"
+    words = [""]
+    for _ in range(5):
+        words = [word + char for word in words for char in alphabet]
+        assert find_afk_typos(words) == [ratio_verdict(word) for word in words]
+
+def test_afk_typos_match_ratio_threshold_on_random_words():
+    rnd = random.Random(0)
+    alphabet = "afkафкAFKАФКлl0 1-x"
+    words = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 8))) for _ in range(20000)]
+    assert find_afk_typos(words) == [ratio_verdict(word) for word in words]
+
+def test_ratio_formula_matches_fuzzywuzzy():
+    """Формула эталона совпадает с fuzz.ratio, если fuzzywuzzy установлен"""
+    fuzz = pytest.importorskip("fuzzywuzzy.fuzz")
+    rnd = random.Random(0)
+    for _ in range(5000):
+        word = "".join(rnd.choice("afkафклx") for _ in range(rnd.randint(1, 6)))
+        for target in ("afk", "афк"):
+            assert baseline_parser.fuzz_ratio(word, target) == fuzz.ratio(word, target)
@@ -0,0 +1,119 @@
+import threading
+import time
+
+from afk_bot import ExpiryScheduler
+
+class Recorder:
+    """Callback, который запоминает вызовы и сигналит о каждом"""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.called = threading.Event()
+
+    def __call__(self, *args):
+        with self.lock:
+            self.calls.append(args)
+        self.called.set()
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+def test_callback_runs_once_with_args():
+    scheduler = ExpiryScheduler()
+    recorder = Recorder()
+    scheduler.schedule("U1", time.time() + 0.02, recorder, "U1", 5)
+    assert scheduler.pending() == 1
+    assert recorder.called.wait(2.0)
+    assert wait_until(lambda: scheduler.pending() == 0)
+    time.sleep(0.05)
+    assert recorder.calls == [("U1", 5)]
+
+def test_cancel_prevents_callback():
+    scheduler = ExpiryScheduler()
+    recorder = Recorder()
+    marker = Recorder()
+    scheduler.schedule("U1", time.time() + 0.05, recorder, "U1")
+    assert scheduler.cancel("U1")
+    assert not scheduler.cancel("U1")
+    assert scheduler.pending() == 0
+    # Задача с более поздним сроком показывает, что поток прошёл срок отменённой
+    scheduler.schedule("U2", time.time() + 0.1, marker, "U2")
+    assert marker.called.wait(2.0)
+    assert recorder.calls == []
+
+def test_reschedule_replaces_earlier_task():
+    scheduler = ExpiryScheduler()
+    first = Recorder()
+    second = Recorder()
+    scheduler.schedule("U1", time.time() + 0.02, first, "old")
+    scheduler.schedule("U1", time.time() + 0.1, second, "new")
+    assert scheduler.pending() == 1
+    assert second.called.wait(2.0)
+    time.sleep(0.05)
+    assert first.calls == []
+    assert second.calls == [("new",)]
+    assert scheduler.pending() == 0
+
+def test_schedule_many_replaces_existing_keys():
+    scheduler = ExpiryScheduler()
+    old = Recorder()
+    new = Recorder()
+    due = time.time() + 0.05
+    scheduler.schedule("U1", due, old, "U1")
+    scheduler.schedule("U2", due, old, "U2")
+    scheduler.schedule_many([
+        ("U1", due + 0.05, new, ("U1",)),
+        ("U3", due + 0.05, new, ("U3",)),
+    ])
+    assert scheduler.pending() == 3
+    assert wait_until(lambda: len(new.calls) == 2)
+    time.sleep(0.05)
+    assert old.calls == [("U2",)]
+    assert sorted(new.calls) == [("U1",), ("U3",)]
+    assert scheduler.pending() == 0
+
+def test_pending_counts_live_tasks():
+    scheduler = ExpiryScheduler()
+    recorder = Recorder()
+    due = time.time() + 60
+    for index in range(10):
+        scheduler.schedule(f"U{index}", due, recorder)
+    for index in range(5):
+        scheduler.schedule(f"U{index}", due + 1, recorder)
+    assert scheduler.pending() == 10
+    for index in range(3):
+        scheduler.cancel(f"U{index}")
+    assert scheduler.pending() == 7
+    assert recorder.calls == []
+
+def test_callback_error_does_not_stop_thread():
+    scheduler = ExpiryScheduler()
+    recorder = Recorder()
+
+    def broken():
+        raise RuntimeError("boom")
+
+    now = time.time()
+    scheduler.schedule("U1", now + 0.01, broken)
+    scheduler.schedule("U2", now + 0.05, recorder, "U2")
+    assert recorder.called.wait(2.0)
+    assert recorder.calls == [("U2",)]
+
+def test_many_tasks_each_run_once():
+    scheduler = ExpiryScheduler()
+    recorder = Recorder()
+    now = time.time()
+    scheduler.schedule_many([(f"U{index}", now + 0.2 + 0.001 * (index % 20), recorder, (f"U{index}",)) for index in range(500)])
+    # Часть задач переносим — они всё равно должны сработать ровно один раз
+    for index in range(0, 500, 7):
+        scheduler.schedule(f"U{index}", now + 0.05, recorder, f"U{index}")
+    assert wait_until(lambda: len(recorder.calls) >= 500)
+    time.sleep(0.05)
+    assert sorted(recorder.calls) == sorted((f"U{index}",) for index in range(500))
+    assert scheduler.pending() == 0
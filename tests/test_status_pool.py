@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+import afk_bot
+from afk_bot import StatusUpdatePool
+
+class BlockingSetStatus:
+    """Подмена set_user_status: запоминает вызовы и держит их, пока не открыт release"""
+
+    def __init__(self, hold=0.0):
+        self.hold = hold
+        self.calls = []
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+
+    def __call__(self, client, user_id, minutes, original_minutes=None, team_id=None):
+        with self.lock:
+            self.calls.append((user_id, minutes))
+            self.running[user_id] = self.running.get(user_id, 0) + 1
+            self.max_running[user_id] = max(self.max_running.get(user_id, 0), self.running[user_id])
+        self.started.release()
+        try:
+            self.release.wait(5.0)
+            time.sleep(self.hold)
+        finally:
+            with self.lock:
+                self.running[user_id] -= 1
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+@pytest.fixture
+def fake_set_status(monkeypatch):
+    fake = BlockingSetStatus()
+    monkeypatch.setattr(afk_bot, "set_user_status", fake)
+    yield fake
+    fake.release.set()
+
+def test_newer_command_replaces_pending_one(fake_set_status):
+    pool = StatusUpdatePool(workers=1)
+    assert pool.submit(None, "U0", 5)
+    assert fake_set_status.started.acquire(timeout=2.0)
+    # Единственный поток занят U0, команды U1 ждут в очереди
+    assert pool.submit(None, "U1", 10)
+    assert pool.submit(None, "U1", 20)
+    assert pool.submit(None, "U1", 30)
+    assert pool.pending() == 1
+    assert pool.stats == {"queued": 2, "coalesced": 2, "dropped": 0}
+    fake_set_status.release.set()
+    assert wait_until(lambda: pool.pending() == 0 and len(fake_set_status.calls) == 2)
+    time.sleep(0.05)
+    assert fake_set_status.calls == [("U0", 5), ("U1", 30)]
+
+def test_same_user_commands_never_overlap(fake_set_status):
+    pool = StatusUpdatePool(workers=4)
+    assert pool.submit(None, "U1", 10)
+    assert fake_set_status.started.acquire(timeout=2.0)
+    # Вторая команда того же пользователя ждёт, хотя свободные потоки есть
+    assert pool.submit(None, "U1", 20)
+    assert not fake_set_status.started.acquire(timeout=0.1)
+    assert fake_set_status.calls == [("U1", 10)]
+    # Команда другого пользователя при этом выполняется
+    assert pool.submit(None, "U2", 15)
+    assert fake_set_status.started.acquire(timeout=2.0)
+    fake_set_status.release.set()
+    assert wait_until(lambda: len(fake_set_status.calls) == 3)
+    assert fake_set_status.calls[-1] == ("U1", 20)
+    assert fake_set_status.max_running == {"U1": 1, "U2": 1}
+
+def test_same_user_commands_never_overlap_under_load(fake_set_status):
+    fake_set_status.hold = 0.001
+    fake_set_status.release.set()
+    pool = StatusUpdatePool(workers=8)
+    for index in range(2000):
+        pool.submit(None, f"U{index % 5}", index)
+    # Последняя команда каждого пользователя применена
+    final = {(f"U{index}", 1995 + index) for index in range(5)}
+    assert wait_until(lambda: final <= set(fake_set_status.calls), timeout=10.0)
+    assert pool.pending() == 0
+    assert set(fake_set_status.max_running.values()) == {1}
+
+def test_new_users_dropped_when_queue_full(fake_set_status):
+    pool = StatusUpdatePool(workers=1, max_pending=2)
+    assert pool.submit(None, "U0", 5)
+    assert fake_set_status.started.acquire(timeout=2.0)
+    assert pool.submit(None, "U1", 10)
+    assert pool.submit(None, "U2", 10)
+    assert not pool.submit(None, "U3", 10)
+    # Уже ждущий пользователь по-прежнему может заменить свою команду
+    assert pool.submit(None, "U1", 20)
+    assert pool.pending() == 2
+    assert pool.stats == {"queued": 3, "coalesced": 1, "dropped": 1}
+    fake_set_status.release.set()
+    assert wait_until(lambda: len(fake_set_status.calls) == 3)
+    time.sleep(0.05)
+    assert fake_set_status.calls == [("U0", 5), ("U1", 20), ("U2", 10)]
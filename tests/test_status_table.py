@@ -0,0 +1,94 @@
+import random
+
+from afk_bot import StatusTable
+
+def expired_users(table, moment):
+    return [user_id for user_id, _ in table.expired_before(moment)]
+
+def test_replaced_status_expires_at_new_time():
+    table = StatusTable()
+    table.set("U1", 10.0, 1)
+    table.set("U1", 30.0, 3)
+    table.set("U2", 20.0, 2)
+    assert expired_users(table, 25.0) == ["U2"]
+    assert [(user_id, record.expiry) for user_id, record in table.pop_expired(25.0)] == [("U2", 20.0)]
+    # Старый элемент кучи U1 (10.0) снят, но сама запись с новым сроком осталась
+    assert table.get("U1").expiry == 30.0
+    assert [user_id for user_id, _ in table.pop_expired(31.0)] == ["U1"]
+    assert len(table) == 0
+
+def test_cancelled_status_is_skipped():
+    table = StatusTable()
+    table.set("U1", 10.0, 1)
+    table.set("U2", 20.0, 2)
+    assert table.cancel("U1")
+    assert not table.cancel("U1")
+    assert expired_users(table, 100.0) == ["U2"]
+    assert [user_id for user_id, _ in table.pop_expired(100.0)] == ["U2"]
+
+def test_cancel_with_changed_expiry_keeps_status():
+    table = StatusTable()
+    table.set("U1", 10.0, 1)
+    table.set("U1", 20.0, 2)
+    assert not table.cancel("U1", 10.0)
+    assert table.cancel("U1", 20.0)
+    assert "U1" not in table
+
+def test_cancel_then_set_same_expiry_returns_status_once():
+    table = StatusTable()
+    table.set("U1", 10.0, 1)
+    table.cancel("U1")
+    table.set("U1", 10.0, 1)
+    table.set("U1", 20.0, 1)
+    table.set("U1", 10.0, 1)
+    # В куче несколько элементов (10.0, "U1"), а статус один
+    assert expired_users(table, 15.0) == ["U1"]
+    assert [user_id for user_id, _ in table.pop_expired(15.0)] == ["U1"]
+    assert table.pop_expired(15.0) == []
+    assert expired_users(table, 100.0) == []
+
+def test_stale_entries_are_compacted():
+    table = StatusTable()
+    for index in range(100):
+        table.set(f"U{index}", float(index), 1)
+    for index in range(90):
+        table.cancel(f"U{index}")
+    # Куча перестроена из живых записей: устаревших элементов меньше, чем отменённых статусов
+    assert len(table._index) < 100
+    assert {(float(index), f"U{index}") for index in range(90, 100)} <= set(table._index)
+    assert expired_users(table, 95.0) == [f"U{index}" for index in range(90, 95)]
+    for index in range(200):
+        table.set("U99", float(index), 1)
+    assert len(table._index) <= 2 * len(table) + 64
+    assert table.get("U99").expiry == 199.0
+
+def test_matches_dict_model():
+    rnd = random.Random(0)
+    table = StatusTable()
+    model = {}
+    now = 0.0
+    for _ in range(20000):
+        user_id = f"U{rnd.randrange(50)}"
+        action = rnd.random()
+        if action < 0.5:
+            expiry = now + rnd.choice((1.0, 2.0, 5.0, 10.0))
+            table.set(user_id, expiry, 1)
+            model[user_id] = expiry
+        elif action < 0.7:
+            expiry = model.get(user_id) if rnd.random() < 0.5 else None
+            assert table.cancel(user_id, expiry) == (user_id in model)
+            model.pop(user_id, None)
+        elif action < 0.85:
+            moment = now + rnd.random() * 5
+            expected = sorted((expiry, user_id) for user_id, expiry in model.items() if expiry < moment)
+            assert sorted((record.expiry, user_id) for user_id, record in table.expired_before(moment)) == expected
+        else:
+            now += rnd.random() * 3
+            expected = sorted((expiry, user_id) for user_id, expiry in model.items() if expiry < now)
+            popped = table.pop_expired(now)
+            assert sorted((record.expiry, user_id) for user_id, record in popped) == expected
+            assert [record.expiry for _, record in popped] == sorted(record.expiry for _, record in popped)
+            for _, user_id in expected:
+                del model[user_id]
+        assert len(table) == len(model)
+        assert len(table._index) <= 2 * len(table) + 64
@@ -0,0 +1,138 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from afk_bot import HashRing, SharedStatusStore, SQLiteStatusStore
+
+class FailingConnection:
+    """Соединение SQLite, у которого первая запись падает, как при "database is locked" """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.failures = 1
+
+    def __enter__(self):
+        return self.connection.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.connection.__exit__(*exc_info)
+
+    def executemany(self, *args):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.connection.executemany(*args)
+
+    def close(self):
+        self.connection.close()
+
+def stored_rows(path):
+    with sqlite3.connect(path) as connection:
+        return dict(connection.execute("SELECT user_id, expiry FROM statuses"))
+
+def test_failed_flush_keeps_batch(tmp_path):
+    path = str(tmp_path / "statuses.db")
+    store = SQLiteStatusStore(path, flush_interval=3600)
+    store.set("U1", 1000.0, 30)
+    store.set("U2", 2000.0, 30)
+    store._connection = FailingConnection(store._connection)
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    # Более новая операция, пришедшая после неудачной записи, не затирается старой
+    store.set("U2", 3000.0, 30)
+    store.delete("U1")
+    store.close()
+    assert stored_rows(path) == {"U2": 3000.0}
+
+def test_close_waits_for_flusher(tmp_path):
+    path = str(tmp_path / "statuses.db")
+    store = SQLiteStatusStore(path, flush_interval=0.001)
+    stop = time.monotonic() + 0.3
+    count = 0
+    while time.monotonic() < stop:
+        store.set(f"U{count}", float(count), 30)
+        count += 1
+    store.close()
+    assert not store._flusher.is_alive()
+    assert len(stored_rows(path)) == count
+
+def test_concurrent_writers_and_close(tmp_path):
+    path = str(tmp_path / "statuses.db")
+    store = SQLiteStatusStore(path, flush_interval=0.001)
+
+    def write(prefix):
+        for index in range(2000):
+            store.set(f"{prefix}{index}", float(index), 30)
+            if index % 100 == 0:
+                store.flush()
+
+    threads = [threading.Thread(target=write, args=(f"W{number}_",)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+    assert len(stored_rows(path)) == 8000
+
+def shared_stores(path):
+    ring = HashRing(["n1", "n2"])
+    return [SharedStatusStore(path, node, ring, flush_interval=3600) for node in ("n1", "n2")]
+
+def test_exactly_one_node_claims_clear(tmp_path):
+    path = str(tmp_path / "statuses.db")
+    first, second = shared_stores(path)
+    user_ids = [f"U{index}" for index in range(300)]
+    for index, user_id in enumerate(user_ids):
+        first.set(user_id, 1000.0 + index, 30, "T1")
+    first.flush()
+    wins = {store.node_id: [] for store in (first, second)}
+    barrier = threading.Barrier(2)
+
+    def claim(store):
+        barrier.wait()
+        for index, user_id in enumerate(user_ids):
+            if store.claim_clear(user_id, 1000.0 + index):
+                wins[store.node_id].append(user_id)
+
+    threads = [threading.Thread(target=claim, args=(store,)) for store in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(wins["n1"] + wins["n2"]) == sorted(user_ids)
+    assert not set(wins["n1"]) & set(wins["n2"])
+    assert stored_rows(path) == {}
+    first.close()
+    second.close()
+
+def test_claim_clear_loses_to_newer_status(tmp_path):
+    path = str(tmp_path / "statuses.db")
+    first, second = shared_stores(path)
+    first.set("U1", 1000.0, 30)
+    first.flush()
+    # Пользователь снова ушёл в AFK до того, как другой узел подобрал старую очистку
+    first.set("U1", 2000.0, 60)
+    first.flush()
+    assert not second.claim_clear("U1", 1000.0)
+    assert stored_rows(path) == {"U1": 2000.0}
+    assert first.claim_clear("U1", 2000.0)
+    assert not second.claim_clear("U1", 2000.0)
+    first.close()
+    second.close()
+
+def test_forward_keeps_latest_command_per_user(tmp_path):
+    path = str(tmp_path / "statuses.db")
+    first, second = shared_stores(path)
+    user_id = next(f"U{index}" for index in range(100) if second.owns(f"U{index}"))
+    other_id = next(f"U{index}" for index in range(100) if second.owns(f"U{index}") and f"U{index}" != user_id)
+    first.forward(user_id, 30, team_id="T1")
+    first.forward(other_id, 15, team_id="T1")
+    first.forward(user_id, 60, 300, team_id="T2")
+    # Команды берёт только узел-владелец
+    assert first.take_commands() == []
+    assert sorted(second.take_commands()) == sorted([(user_id, 60, 300, "T2"), (other_id, 15, None, "T1")])
+    assert second.take_commands() == []
+    first.close()
+    second.close()